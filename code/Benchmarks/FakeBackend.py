@@ -0,0 +1,323 @@
+'''
+In-process stand-in for the DIRAC services, used to benchmark the API and the workflow modules offline.
+
+The backend holds an in-memory WMS, a file catalog, storage elements stored in a temporary directory,
+a configuration tree and a job report sink. Every call can be slowed down and made to fail on purpose:
+
+>>> backend = FakeBackend(latency = {'WMS' : 0.05, 'SE' : 0.2}, failureRate = {'SE' : 0.1}, seed = 1)
+>>> dirac = FakeDirac(backend)
+>>> job = backend.getUserJob()
+>>> module = backend.setupModule(UserJobFinalization())
+
+All the calls return S_OK/S_ERROR like the services they replace.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from Interfaces.API.Dirac                 import Dirac
+from DIRAC                                import S_OK, S_ERROR
+
+import os, time, random, shutil, tempfile, threading
+
+#: Services that can be slowed down or made to fail
+SERVICES = ['WMS', 'Catalog', 'SE', 'JobReport']
+
+class FakeBackend(object):
+    """ In-memory WMS, file catalog, storage elements, configuration and job reports
+    """
+    def __init__(self, latency = 0., failureRate = 0., seed = None, config = None, storageDir = ''):
+        """
+        @param latency: seconds added to every call, or {service: seconds}
+        @param failureRate: probability that a call fails, or {service: probability}
+        @param seed: seed of the failure injection, for reproducible runs
+        @param config: configuration tree {path: value}, the paths being the ones used with Operations and gConfig
+        @param storageDir: where the SEs store the files, a temporary directory by default
+        """
+        self.latency = self._perService(latency)
+        self.failureRate = self._perService(failureRate)
+        self.random = random.Random(seed)
+        self.config = config or {}
+        self.ownStorage = not storageDir
+        self.storageDir = storageDir or tempfile.mkdtemp(prefix = 'FakeSE_')
+        self.jobs = {}
+        self.jobParameters = {}
+        self.replicas = {}
+        self.applicationStatus = []
+        self.calls = dict([(service, 0) for service in SERVICES])
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _perService(value):
+        """ Expand a single value to all the services
+        """
+        if type(value) == type({}):
+            return dict([(service, value.get(service, 0.)) for service in SERVICES])
+        return dict([(service, value) for service in SERVICES])
+
+    def _call(self, service):
+        """ Count the call, apply the latency and maybe fail
+        """
+        self._lock.acquire()
+        try:
+            self.calls[service] += 1
+            failed = self.random.random() < self.failureRate[service]
+        finally:
+            self._lock.release()
+        if self.latency[service]:
+            time.sleep(self.latency[service])
+        if failed:
+            return S_ERROR('Injected failure in %s' % service)
+        return S_OK()
+
+    def cleanUp(self):
+        """ Remove the files stored in the SEs
+        """
+        if self.ownStorage and os.path.isdir(self.storageDir):
+            shutil.rmtree(self.storageDir)
+
+    #############################################################################
+    # WMS
+    def submitJob(self, jdl):
+        """ Store the JDL, return a new job ID
+        """
+        res = self._call('WMS')
+        if not res['OK']:
+            return res
+        self._lock.acquire()
+        try:
+            jobID = len(self.jobs) + 1
+            self.jobs[jobID] = jdl
+            self.jobParameters[jobID] = {}
+        finally:
+            self._lock.release()
+        return S_OK(jobID)
+
+    def getJobParameters(self, jobID):
+        """ Parameters set by the job report of the job
+        """
+        res = self._call('WMS')
+        if not res['OK']:
+            return res
+        if not self.jobParameters.has_key(jobID):
+            return S_ERROR('No such job %s' % jobID)
+        return S_OK(dict(self.jobParameters[jobID]))
+
+    #############################################################################
+    # Catalog and SEs
+    def getReplicas(self, lfns):
+        """ Same structure as the catalog getReplicas
+        """
+        res = self._call('Catalog')
+        if not res['OK']:
+            return res
+        if type(lfns) in (type(''), type(u'')):
+            lfns = [lfns]
+        successful = {}
+        failed = {}
+        for lfn in lfns:
+            if self.replicas.get(lfn):
+                successful[lfn] = dict(self.replicas[lfn])
+            else:
+                failed[lfn] = 'No such file or directory'
+        return S_OK({'Successful' : successful, 'Failed' : failed})
+
+    def addFile(self, lfn, se = 'FAKE-SE'):
+        """ Register an LFN without storing anything, e.g. for sandbox LFNs
+        """
+        self._lock.acquire()
+        try:
+            self.replicas.setdefault(lfn, {})[se] = lfn
+        finally:
+            self._lock.release()
+
+    def putAndRegister(self, lfn, localPath, se):
+        """ Copy the file to the SE directory and register the replica
+        """
+        res = self._call('SE')
+        if not res['OK']:
+            return res
+        pfn = os.path.join(self.storageDir, se, lfn.lstrip('/'))
+        try:
+            if not os.path.isdir(os.path.dirname(pfn)):
+                os.makedirs(os.path.dirname(pfn))
+            shutil.copy(localPath, pfn)
+        except EnvironmentError, why:
+            return S_ERROR('Failed to store %s in %s: %s' % (lfn, se, str(why)))
+        res = self._call('Catalog')
+        if not res['OK']:
+            return res
+        self._lock.acquire()
+        try:
+            self.replicas.setdefault(lfn, {})[se] = pfn
+        finally:
+            self._lock.release()
+        return S_OK(pfn)
+
+    def replicate(self, lfn, se):
+        """ Copy an existing replica to another SE
+        """
+        replicas = self.replicas.get(lfn)
+        if not replicas:
+            return S_ERROR('No replica of %s' % lfn)
+        return self.putAndRegister(lfn, replicas.values()[0], se)
+
+    #############################################################################
+    # Configuration
+    def getValue(self, path, default = None):
+        """ Value of the configuration, or the default
+        """
+        return self.config.get(path, default)
+
+    def getOptionsDict(self, path):
+        """ Options directly under the path
+        """
+        prefix = path.rstrip('/') + '/'
+        options = {}
+        for key, value in self.config.items():
+            if key.startswith(prefix) and not '/' in key[len(prefix):]:
+                options[key[len(prefix):]] = value
+        if not options:
+            return S_ERROR('Path %s does not exist' % path)
+        return S_OK(options)
+
+    #############################################################################
+    # Plugging into the API and the modules
+    def getProxyInfo(self):
+        """ Proxy information of a user proxy
+        """
+        return S_OK({'group' : 'user', 'username' : 'fakeuser', 'VOMS' : [], 'secondsLeft' : 86400})
+
+    def getUserJob(self, script = None):
+        """ A UserJob using the fake proxy, that does not prompt
+        """
+        from Interfaces.API.UserJob import UserJob
+        job = UserJob(script)
+        job.proxyinfo = self.getProxyInfo()
+        job.dontPromptMe()
+        return job
+
+    def setupModule(self, module, jobID = 12345):
+        """ Make a workflow module use the backend. Returns the module.
+        """
+        module.ops = FakeOperations(self)
+        module.jobID = jobID
+        module.workflow_commons['JobReport'] = FakeJobReport(self, jobID)
+        module.workflow_commons.setdefault('JOB_ID', jobID)
+        module.workflow_commons.setdefault('Owner', 'fakeuser')
+        module.workflow_commons.setdefault('VO', 'fakevo')
+        if hasattr(module, '_getFailoverTransfer'):
+            module._getFailoverTransfer = lambda request: FakeFailoverTransfer(self, request)
+        if hasattr(module, '_getReplicaManager'):
+            module._getReplicaManager = lambda: FakeReplicaManager(self)
+        if hasattr(module, 'failoverSEs'):
+            module.failoverSEs = self.getValue('/Resources/StorageElementGroups/Tier1-Failover', ['FAKE-FAILOVER'])
+        if hasattr(module, 'defaultOutputSE'):
+            module.defaultOutputSE = self.getValue('/Resources/StorageElementGroups/Tier1-USER', ['FAKE-SE'])
+        return module
+
+class FakeOperations(object):
+    """ Replaces Operations
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def getValue(self, path, default = None):
+        return self.backend.getValue(path, default)
+
+    def getOptionsDict(self, path):
+        return self.backend.getOptionsDict(path)
+
+class FakeJobReport(object):
+    """ Replaces JobReport: collects the statuses and parameters in the backend
+    """
+    def __init__(self, backend, jobID):
+        self.backend = backend
+        self.jobID = jobID
+
+    def setApplicationStatus(self, status, sendFlag = True):
+        res = self.backend._call('JobReport')
+        if not res['OK']:
+            return res
+        self.backend.applicationStatus.append((self.jobID, status))
+        return S_OK()
+
+    def setJobParameter(self, name, value, sendFlag = True):
+        res = self.backend._call('JobReport')
+        if not res['OK']:
+            return res
+        self.backend.jobParameters.setdefault(self.jobID, {})[name] = value
+        return S_OK()
+
+    def generateForwardDISET(self):
+        return S_OK(None)
+
+class FakeFailoverTransfer(object):
+    """ Replaces FailoverTransfer
+    """
+    def __init__(self, backend, request):
+        self.backend = backend
+        self.request = request
+
+    def transferAndRegisterFile(self, fileName, localPath, lfn, destinationSEList, fileMetaDict = None,
+                                fileCatalog = None):
+        for se in destinationSEList:
+            res = self.backend.putAndRegister(lfn, localPath, se)
+            if res['OK']:
+                return S_OK({'uploadedSE' : se, 'lfn' : lfn})
+        return S_ERROR('Could not upload %s to any of %s' % (fileName, ', '.join(destinationSEList)))
+
+    def transferAndRegisterFileFailover(self, fileName, localPath, lfn, targetSE, failoverSEList,
+                                        fileMetaDict = None, fileCatalog = None):
+        res = self.transferAndRegisterFile(fileName, localPath, lfn, failoverSEList, fileMetaDict, fileCatalog)
+        if not res['OK']:
+            return res
+        #The request to move the file to the targetSE would be executed later, do it now
+        self.backend.replicate(lfn, targetSE)
+        return res
+
+class FakeReplicaManager(object):
+    """ Replaces ReplicaManager
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def getReplicas(self, lfns):
+        return self.backend.getReplicas(lfns)
+
+    def replicateAndRegister(self, lfn, se, catalog = None):
+        return self.backend.replicate(lfn, se)
+
+class FakeDirac(Dirac):
+    """ Dirac API doing the checks, but sending the jobs to the fake WMS
+
+    The DIRAC API is not initialized: it would contact the configuration and the services. The configuration
+    is read from the backend from the start, e.g. for the LFNCache and SandboxStore options.
+    """
+    def __init__(self, backend, withRepo = False, repoLocation = ''):
+        self.backend = backend
+        self.jobRepo = None
+        if withRepo:
+            from DIRAC.Interfaces.API.JobRepository import JobRepository
+            self.jobRepo = JobRepository(repoLocation)
+        self._initialize(FakeOperations(backend))
+
+    def submit(self, job, mode = 'wms'):
+        res = self.preSubmissionChecks(job, mode)
+        if not res['OK']:
+            return res
+        return self.backend.submitJob(job._toJDL())
+
+    def getReplicas(self, lfns, active = True, printOutput = False):
+        return self.backend.getReplicas(lfns)
+
+    def parameters(self, jobID, printOutput = False):
+        return self.backend.getJobParameters(jobID)
+
+    def addFile(self, lfn, fullPath, diracSE, fileGuid = None, printOutput = False):
+        return self.backend.putAndRegister(lfn, fullPath, diracSE)
+
+    def _getSandboxStorePath(self):
+        username = self.backend.getProxyInfo()['Value']['username']
+        return S_OK('/fakevo/user/%s/%s/SandboxStore' % (username[0], username))
@@ -0,0 +1,197 @@
+'''
+End-to-end benchmark of the job life cycle, phase by phase, against the L{FakeBackend}.
+
+The phases are:
+  - build: creating the applications and calling Job.append
+  - workflow: Job._addToWorkflow
+  - check: Dirac._do_check, i.e. the input sandbox resolution and LFN checks
+  - execute: ModuleBase.execute of an ApplicationScript step running a payload
+  - finalization: UserJobFinalization.execute uploading the outputs
+
+Each phase reports its wall time, CPU time and the peak memory of the process during the phase (PeakRSS).
+The peak is reset at the start of each phase through /proc/self/clear_refs. Where that is not possible, the
+peak of the process since it started is reported instead, as CumulativePeakRSS.
+Use run_suite.py to run it and compare_results.py to compare two runs.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from DIRAC                                import S_OK, S_ERROR
+
+import os, time, resource, shutil, tempfile
+
+#: Default parameters of a scenario
+DEFAULT_PARAMETERS = {'NbApplications' : 2, 'NbJobs' : 100, 'SandboxSize' : 10, 'NbOutputs' : 5,
+                      'LogLines' : 10000}
+
+#: Quantities compared between runs, a phase has either PeakRSS or CumulativePeakRSS
+METRICS = ['Wall', 'CPU', 'PeakRSS', 'CumulativePeakRSS']
+
+def resetPeakRSS():
+    """ Reset the peak resident memory of the process (VmHWM), see proc(5)
+    @return: True if it was reset
+    """
+    try:
+        clearRefs = open('/proc/self/clear_refs', 'w')
+        try:
+            clearRefs.write('5')
+        finally:
+            clearRefs.close()
+    except EnvironmentError:
+        return False
+    return True
+
+def getPeakRSS():
+    """ Peak resident memory of the process since it started or since L{resetPeakRSS}, in bytes
+    @return: bytes, or None if /proc/self/status is not available
+    """
+    try:
+        status = open('/proc/self/status')
+        try:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+        finally:
+            status.close()
+    except (EnvironmentError, ValueError, IndexError):
+        pass
+    return None
+
+class PhaseTimer(object):
+    """ Measure the phases of a run
+
+    >>> timer = PhaseTimer()
+    >>> with timer.phase('build'):
+    ...     build()
+    """
+    def __init__(self):
+        self.phases = {}
+        self._current = None
+
+    def phase(self, name):
+        self._current = name
+        return self
+
+    def __enter__(self):
+        self._peakReset = resetPeakRSS()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._start = (time.time(), usage.ru_utime + usage.ru_stime)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        values = {'Wall' : time.time() - self._start[0],
+                  'CPU' : usage.ru_utime + usage.ru_stime - self._start[1]}
+        peak = None
+        if self._peakReset:
+            peak = getPeakRSS()
+        if peak is None:
+            values['CumulativePeakRSS'] = usage.ru_maxrss * 1024
+        else:
+            values['PeakRSS'] = peak
+        self.phases[self._current] = values
+        return False
+
+def runScenario(backend, parameters = None):
+    """ Run all the phases once.
+
+    @param backend: L{FakeBackend} instance
+    @param parameters: overrides of L{DEFAULT_PARAMETERS}
+    @return: S_OK({'Parameters': {...}, 'Phases': {phase: {'Wall', 'CPU', 'PeakRSS' or 'CumulativePeakRSS'}}})
+    """
+    from Interfaces.API.GenericApplication       import GenericApplication
+    from Benchmarks.FakeBackend                  import FakeDirac
+    from Workflow.Modules.ApplicationScript      import ApplicationScript
+    from Workflow.Modules.UserJobFinalization    import UserJobFinalization
+
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(parameters or {})
+    timer = PhaseTimer()
+    basedir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix = 'Benchmark_')
+    os.chdir(workdir)
+    try:
+        script = open('payload.sh', 'w')
+        script.write('#!/bin/sh\nfor i in $(seq %s); do echo "line $i"; done\n' % params['LogLines'])
+        script.write('for i in $(seq %s); do echo output > output_$i.ext; done\n' % params['NbOutputs'])
+        script.close()
+        os.chmod('payload.sh', 0755)
+        sandbox = []
+        for index in xrange(params['SandboxSize']):
+            fileName = 'sandbox_%s.txt' % index
+            open(fileName, 'w').close()
+            sandbox.append(fileName)
+        backend.addFile('/fakevo/user/f/fakeuser/lib.tar.gz')
+        sandbox.append('LFN:/fakevo/user/f/fakeuser/lib.tar.gz')
+
+        with timer.phase('build'):
+            jobs = []
+            for _ in xrange(params['NbJobs']):
+                job = backend.getUserJob()
+                for index in xrange(params['NbApplications']):
+                    app = GenericApplication()
+                    app.setScript('payload.sh')
+                    app.setOutputFile('output_%s.ext' % index)
+                    res = job.append(app)
+                    if not res['OK']:
+                        return res
+                job.setInputSandbox(list(sandbox))
+                jobs.append(job)
+
+        with timer.phase('workflow'):
+            for job in jobs:
+                res = job._addToWorkflow()
+                if not res['OK']:
+                    return res
+
+        dirac = FakeDirac(backend)
+        with timer.phase('check'):
+            for job in jobs:
+                res = dirac._do_check(job)
+                if not res['OK']:
+                    return res
+
+        module = backend.setupModule(ApplicationScript())
+        module.script = 'payload.sh'
+        module.step_commons = {'STEP_DEFINITION_NAME' : 'payload_step', 'applicationLog' : 'payload.log'}
+        with timer.phase('execute'):
+            res = module.execute()
+            if not res['OK']:
+                return res
+
+        os.environ['JOBID'] = '12345'
+        module = backend.setupModule(UserJobFinalization())
+        module.step_commons = {'STEP_NUMBER' : 1}
+        module.workflow_commons.update({'TotalSteps' : 1, 'UserOutputData' : 'output_*.ext'})
+        with timer.phase('finalization'):
+            res = module.execute()
+            if not res['OK']:
+                return res
+    finally:
+        os.chdir(basedir)
+        shutil.rmtree(workdir)
+    return S_OK({'Parameters' : params, 'Phases' : timer.phases})
+
+def compareResults(reference, current, threshold = 0.1):
+    """ Find the phases that got slower or bigger than the reference by more than threshold
+
+    @param reference: result of L{runScenario}
+    @param current: result of L{runScenario}
+    @param threshold: relative increase considered a regression
+    @return: S_OK(list of (phase, metric, reference value, current value))
+    """
+    if reference['Parameters'] != current['Parameters']:
+        return S_ERROR('The runs used different parameters')
+    regressions = []
+    for phase, values in sorted(current['Phases'].items()):
+        if not reference['Phases'].has_key(phase):
+            continue
+        for metric in METRICS:
+            if not values.has_key(metric) or not reference['Phases'][phase].has_key(metric):
+                continue
+            refValue = reference['Phases'][phase][metric]
+            if refValue > 0 and (values[metric] - refValue) / float(refValue) > threshold:
+                regressions.append((phase, metric, refValue, values[metric]))
+    return S_OK(regressions)
@@ -0,0 +1,47 @@
+#!/bin/env python
+'''
+Compare the time needed to build applications from a parameter dictionary with the setter
+dispatch table and with the former exec based Application._setparams.
+
+Usage: python application_construction.py [number of applications]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, S_OK, exit as dexit
+
+    from Interfaces.API.GenericApplication import GenericApplication
+
+    import sys, time, types
+
+    class ExecApplication(GenericApplication):
+        """ Calls the setters like before the dispatch table
+        """
+        def _setparams(self, params):
+            if not params:
+                return S_OK()
+            for param, value in params.items():
+                if type(value) in types.StringTypes:
+                    value = "'%s'" % value
+                try:
+                    exec "self.set%s(%s)" % (param, str(value))
+                except:
+                    self._log.error("The %s class does not have a set%s method." % (self.__class__.__name__, param))
+            return S_OK()
+
+    nbapps = 100000
+    if len(sys.argv) > 1:
+        nbapps = int(sys.argv[1])
+
+    params = {"Version" : "v1", "Arguments" : "some arguments", "Dependency" : {"root" : "5.34"},
+              "OutputFile" : "out.ext", "ExtraCLIArguments" : "--more", "Debug" : True}
+    for appclass in (ExecApplication, GenericApplication):
+        start = time.time()
+        for _ in xrange(nbapps):
+            appclass(params)
+        duration = time.time() - start
+        gLogger.notice("%-20s: %.0f applications/s" % (appclass.__name__, nbapps / duration))
+    dexit(0)
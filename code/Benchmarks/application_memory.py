@@ -0,0 +1,43 @@
+#!/bin/env python
+'''
+Report the memory used per application when holding many of them, as done for parametric jobs.
+
+Usage: python application_memory.py [number of applications]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, exit as dexit
+
+    from Interfaces.API.GenericApplication import GenericApplication
+
+    import sys, os, gc
+
+    def getRSS():
+        """ Resident memory of the process in bytes
+        """
+        statm = open("/proc/self/statm")
+        pages = int(statm.read().split()[1])
+        statm.close()
+        return pages * os.sysconf("SC_PAGE_SIZE")
+
+    nbapps = 100000
+    if len(sys.argv) > 1:
+        nbapps = int(sys.argv[1])
+
+    gc.collect()
+    before = getRSS()
+    apps = []
+    for index in xrange(nbapps):
+        app = GenericApplication()
+        app.setArguments("%s" % index)
+        app.setOutputFile("out_%s.ext" % index)
+        apps.append(app)
+    gc.collect()
+    after = getRSS()
+
+    gLogger.notice("%s applications: %.0f bytes per application" % (nbapps, float(after - before) / nbapps))
+    dexit(0)
@@ -0,0 +1,69 @@
+#!/bin/env python
+'''
+Compare the submission rate of a loop over UserJob.submit with UserJob.submitBulk.
+
+The jobs are sent to the in-memory WMS of the FakeBackend.
+
+Usage: python bulk_submission.py [number of jobs]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, exit as dexit
+
+    from Interfaces.API.GenericApplication import GenericApplication
+    from Benchmarks.FakeBackend            import FakeBackend, FakeDirac
+
+    import os, sys, time, shutil, tempfile
+
+    def getJob(backend, index = 0):
+        """ Same job as in the example
+        """
+        app = GenericApplication()
+        app.setScript(script)
+        app.setArguments('something or another')
+        app.setOutputFile("something_%s.ext" % index)
+        job = backend.getUserJob()
+        job.setName("DummyJob_%s" % index)
+        job.setCPUTime(1000)
+        res = job.append(app)
+        if not res['OK']:
+            gLogger.error(res['Message'])
+            dexit(1)
+        return job
+
+    nbjobs = 1000
+    if len(sys.argv) > 1:
+        nbjobs = int(sys.argv[1])
+
+    workdir = tempfile.mkdtemp(prefix = 'BulkSubmission_')
+    script = os.path.join(workdir, "hello.sh")
+    open(script, "w").close()
+
+    backend = FakeBackend()
+    dirac = FakeDirac(backend)
+    start = time.time()
+    for index in xrange(nbjobs):
+        res = getJob(backend, index).submit(dirac)
+        if not res['OK']:
+            gLogger.error(res['Message'])
+            dexit(1)
+    loop = time.time() - start
+
+    dirac = FakeDirac(backend)
+    start = time.time()
+    res = getJob(backend).submitBulk([{'Name' : "DummyJob_%s" % index, 'Arguments' : str(index)}
+                                      for index in xrange(nbjobs)], dirac)
+    bulk = time.time() - start
+    backend.cleanUp()
+    shutil.rmtree(workdir)
+    if not res['OK']:
+        gLogger.error(res['Message'])
+        dexit(1)
+
+    gLogger.notice("submit loop : %.1f jobs/s" % (nbjobs / loop))
+    gLogger.notice("submitBulk  : %.1f jobs/s (%s failed)" % (nbjobs / bulk, len(res['Value']['Failed'])))
+    dexit(0)
@@ -0,0 +1,38 @@
+#!/bin/env python
+'''
+Compare two result files of run_suite.py, and list the phases that regressed.
+
+Usage: python compare_results.py reference.json current.json [threshold]
+
+The threshold is the relative increase considered a regression, 0.1 by default.
+The exit code is 1 if there are regressions.
+'''
+
+if __name__=="__main__":
+    from Benchmarks.Suite                  import compareResults
+
+    import sys, json
+
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(2)
+    threshold = 0.1
+    if len(sys.argv) > 3:
+        threshold = float(sys.argv[3])
+    results = []
+    for fileName in sys.argv[1:3]:
+        resultFile = open(fileName)
+        results.append(json.load(resultFile))
+        resultFile.close()
+
+    res = compareResults(results[0], results[1], threshold)
+    if not res['OK']:
+        print res['Message']
+        sys.exit(2)
+    for phase, metric, refValue, value in res['Value']:
+        print "REGRESSION %-15s %-17s %12.3f -> %12.3f (%+.0f%%)" % (phase, metric, refValue, value,
+                                                                  100. * (value - refValue) / refValue)
+    if res['Value']:
+        sys.exit(1)
+    print "No regression above %.0f%%" % (100 * threshold)
+    sys.exit(0)
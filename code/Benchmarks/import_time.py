@@ -0,0 +1,64 @@
+#!/bin/env python
+'''
+Measure the time needed to import the API modules, each in a fresh interpreter, and check that
+the heavy DIRAC modules are not imported with them.
+
+Usage: python import_time.py [number of runs]
+
+The import of the DIRAC base classes cannot be deferred, the API classes inherit from them: it is
+printed first, and each module is also given relative to it, which is the part the deferred imports
+can reduce. The exit code is 1 if one of the DEFERRED modules got imported at import time, unless the
+DIRAC base classes import it themselves.
+'''
+
+#: API modules to import
+MODULES = ['Interfaces.API.Application', 'Interfaces.API.GenericApplication', 'Interfaces.API.Job',
+           'Interfaces.API.UserJob', 'Interfaces.API.Dirac']
+
+#: Modules that must only be imported when used
+DEFERRED = ['DIRAC.Core.Utilities.PromptUser', 'DIRAC.Core.Workflow.Step',
+            'DIRAC.ConfigurationSystem.Client.Helpers.Registry', 'DIRAC.Core.Security.ProxyInfo']
+
+#: DIRAC classes the API classes inherit from, they are always imported
+BASES = ['DIRAC.Interfaces.API.Job', 'DIRAC.Interfaces.API.Dirac']
+
+PROBE = """
+import sys, time
+start = time.time()
+import %s
+duration = time.time() - start
+print duration
+print ' '.join([name for name in %r if name in sys.modules])
+"""
+
+if __name__=="__main__":
+    import sys, subprocess
+
+    nbruns = 5
+    if len(sys.argv) > 1:
+        nbruns = int(sys.argv[1])
+
+    durations = []
+    for _ in xrange(nbruns):
+        output = subprocess.Popen([sys.executable, '-c', PROBE % (", ".join(BASES), DEFERRED)],
+                                  stdout = subprocess.PIPE).communicate()[0].split('\n')
+        durations.append(float(output[0]))
+    fromBases = output[1].split()
+    basesDuration = min(durations)
+    print "%-35s: %6.1f ms" % ('DIRAC base classes', 1000 * basesDuration)
+
+    regressions = False
+    for module in MODULES:
+        durations = []
+        loaded = ''
+        for _ in xrange(nbruns):
+            output = subprocess.Popen([sys.executable, '-c', PROBE % (module, DEFERRED)],
+                                      stdout = subprocess.PIPE).communicate()[0].split('\n')
+            durations.append(float(output[0]))
+            loaded = ' '.join([name for name in output[1].split() if not name in fromBases])
+        print "%-35s: %6.1f ms (%+.1f ms over the base classes)" % (module, 1000 * min(durations),
+                                                                     1000 * (min(durations) - basesDuration))
+        if loaded:
+            print "    imports %s" % loaded
+            regressions = True
+    sys.exit(regressions and 1 or 0)
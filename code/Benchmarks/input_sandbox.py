@@ -0,0 +1,76 @@
+#!/bin/env python
+'''
+Compare the assembly and flattening of a large input sandbox with the former way of doing it,
+i.e. a membership test on the list in Job.append and list.remove while iterating in Dirac._do_check.
+
+Usage: python input_sandbox.py [number of entries]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, S_OK, S_ERROR, exit as dexit
+
+    from Core.Utilities.InputSandbox import flattenInputSandbox
+
+    import sys, time
+
+    def formerAssembly(applicationSandboxes, userSandbox):
+        """ Job.append and UserJob.setInputSandbox, then Dirac._do_check
+        """
+        inputsandbox = []
+        for appsandbox in applicationSandboxes:
+            for isb in appsandbox:
+                if not isb in inputsandbox:
+                    inputsandbox.append(isb)
+        inputsandbox.extend(userSandbox)
+        for items in list(inputsandbox):
+            if type(items) == type([]):
+                for f in items:
+                    if type(f) == type([]):
+                        return S_ERROR("Too many lists of lists in the input sandbox, please fix!")
+                    inputsandbox.append(f)
+                inputsandbox.remove(items)
+        return S_OK(inputsandbox)
+
+    def currentAssembly(applicationSandboxes, userSandbox):
+        """ Job._addToInputSandbox, then Dirac._do_check
+        """
+        seen = set()
+        inputsandbox = []
+        for appsandbox in applicationSandboxes + [userSandbox]:
+            res = flattenInputSandbox(appsandbox, seen)
+            if not res['OK']:
+                return res
+            inputsandbox.extend(res['Value']['Files'])
+        res = flattenInputSandbox(inputsandbox)
+        if not res['OK']:
+            return res
+        return S_OK(res['Value']['Files'])
+
+    nbentries = 10000
+    if len(sys.argv) > 1:
+        nbentries = int(sys.argv[1])
+
+    #Two applications sharing half of their files, and a user sandbox given as lists of lists
+    applicationSandboxes = [['file_%s.txt' % index for index in xrange(nbentries / 2)],
+                            ['file_%s.txt' % index for index in xrange(nbentries / 4, 3 * nbentries / 4)]]
+    userSandbox = [['user_%s.txt' % index for index in xrange(start, start + 100)]
+                   for start in xrange(0, nbentries / 4, 100)]
+
+    results = {}
+    for assembly in (formerAssembly, currentAssembly):
+        start = time.time()
+        res = assembly(applicationSandboxes, userSandbox)
+        duration = time.time() - start
+        if not res['OK']:
+            gLogger.error(res['Message'])
+            dexit(1)
+        results[assembly.__name__] = res['Value']
+        gLogger.notice("%-16s: %d files in %.3f s" % (assembly.__name__, len(res['Value']), duration))
+    if sorted(results['formerAssembly']) != sorted(results['currentAssembly']):
+        gLogger.error("The input sandboxes differ")
+        dexit(1)
+    dexit(0)
@@ -0,0 +1,63 @@
+#!/bin/env python
+'''
+Measure the time spent in ModuleBase.redirectLogOutput for a payload printing many lines,
+compared to the former implementation opening the log file for every line.
+
+Usage: python log_writer.py [number of lines]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, exit as dexit
+
+    from Workflow.Modules.ModuleBase import ModuleBase
+
+    import sys, os, time, tempfile, shutil
+
+    class OpenCloseModule(ModuleBase):
+        """ Writes the log like before the LogSink
+        """
+        def __init__(self):
+            super(OpenCloseModule, self).__init__()
+            self.stdErrorString = ''
+
+        def redirectLogOutput(self, fd, message):
+            sys.stdout.flush()
+            if message:
+                print message
+            if self.applicationLog:
+                log = open(self.applicationLog, 'a')
+                log.write(message+'\n')
+                log.close()
+            if fd == 1:
+                self.stdErrorString += message
+
+    nblines = 1000000
+    if len(sys.argv) > 1:
+        nblines = int(sys.argv[1])
+
+    workdir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    results = []
+    try:
+        for moduleclass in (OpenCloseModule, ModuleBase):
+            module = moduleclass()
+            module.applicationLog = os.path.join(workdir, "%s.log" % moduleclass.__name__)
+            sys.stdout = open(os.devnull, 'w')
+            start = time.time()
+            for index in xrange(nblines):
+                module.redirectLogOutput(index % 10 == 0 and 1 or 0, "Payload line number %s" % index)
+            module.logSink.close()
+            results.append((moduleclass.__name__, time.time() - start))
+            sys.stdout.close()
+            sys.stdout = stdout
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(workdir)
+
+    for name, duration in results:
+        gLogger.notice("%-15s: %.2f s for %s lines" % (name, duration, nblines))
+    dexit(0)
@@ -0,0 +1,72 @@
+#!/bin/env python
+'''
+Run the benchmark suite and store the results as JSON.
+
+Usage: python run_suite.py [--jobs=N] [--applications=N] [--sandbox=N] [--outputs=N] [--loglines=N]
+                           [--latency=seconds] [--repeat=N] result.json
+
+Compare two result files with compare_results.py
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.registerSwitch("", "jobs=", "Number of jobs")
+    Script.registerSwitch("", "applications=", "Number of applications per job")
+    Script.registerSwitch("", "sandbox=", "Number of input sandbox files")
+    Script.registerSwitch("", "outputs=", "Number of output files")
+    Script.registerSwitch("", "loglines=", "Number of lines printed by the payload")
+    Script.registerSwitch("", "latency=", "Latency of the fake services, in seconds")
+    Script.registerSwitch("", "repeat=", "Number of runs, the best of each phase is kept")
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, exit as dexit
+
+    from Benchmarks.FakeBackend            import FakeBackend
+    from Benchmarks.Suite                  import runScenario, METRICS
+
+    import json
+
+    switches = {'jobs' : 'NbJobs', 'applications' : 'NbApplications', 'sandbox' : 'SandboxSize',
+                'outputs' : 'NbOutputs', 'loglines' : 'LogLines'}
+    parameters = {}
+    latency = 0.
+    repeat = 1
+    for switch, value in Script.getUnprocessedSwitches():
+        if switches.has_key(switch):
+            parameters[switches[switch]] = int(value)
+        elif switch == 'latency':
+            latency = float(value)
+        elif switch == 'repeat':
+            repeat = int(value)
+    args = Script.getPositionalArgs()
+    if len(args) != 1:
+        Script.showHelp()
+        dexit(1)
+
+    results = None
+    for _ in xrange(repeat):
+        backend = FakeBackend(latency = latency, seed = 1)
+        res = runScenario(backend, parameters)
+        backend.cleanUp()
+        if not res['OK']:
+            gLogger.error(res['Message'])
+            dexit(1)
+        if results is None:
+            results = res['Value']
+            continue
+        for phase, values in res['Value']['Phases'].items():
+            for metric in METRICS:
+                if values.has_key(metric) and results['Phases'][phase].has_key(metric):
+                    results['Phases'][phase][metric] = min(results['Phases'][phase][metric], values[metric])
+
+    for phase, values in sorted(results['Phases'].items()):
+        if values.has_key('PeakRSS'):
+            peak = "peak rss %8.1f MB" % (values['PeakRSS'] / 1048576.)
+        else:
+            peak = "cumulative peak rss %8.1f MB" % (values['CumulativePeakRSS'] / 1048576.)
+        gLogger.notice("%-15s wall %8.3f s  cpu %8.3f s  %s" % (phase, values['Wall'], values['CPU'], peak))
+    resultFile = open(args[0], 'w')
+    json.dump(results, resultFile, indent = 2, sort_keys = True)
+    resultFile.close()
+    dexit(0)
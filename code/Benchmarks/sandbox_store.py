@@ -0,0 +1,68 @@
+#!/bin/env python
+'''
+Compare the bytes shipped in the input sandboxes of many identical jobs with and without the
+content addressed sandbox store (/SandboxStore/Enabled).
+
+The jobs are sent to the in-memory WMS of the FakeBackend, the stored contents go to its FAKE-SE.
+
+Usage: python sandbox_store.py [number of jobs] [sandbox size in MB]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, exit as dexit
+
+    from Interfaces.API.GenericApplication import GenericApplication
+    from Benchmarks.FakeBackend            import FakeBackend, FakeDirac
+
+    import os, sys, time, shutil, tempfile
+
+    nbjobs = 100
+    if len(sys.argv) > 1:
+        nbjobs = int(sys.argv[1])
+    sandboxSize = 20
+    if len(sys.argv) > 2:
+        sandboxSize = int(sys.argv[2])
+
+    workdir = tempfile.mkdtemp(prefix = 'SandboxStore_')
+    sandbox = []
+    for name in ['lib.tar.gz', 'steering.xml', 'run.sh']:
+        fileName = os.path.join(workdir, name)
+        localFile = open(fileName, 'wb')
+        localFile.write(os.urandom(sandboxSize * 1048576 / 3))
+        localFile.close()
+        sandbox.append(fileName)
+    open("hello.sh", "w").close()
+
+    exitCode = 0
+    for enabled in (False, True):
+        backend = FakeBackend(config = {'/SandboxStore/Enabled' : enabled, '/SandboxStore/SE' : 'FAKE-SE',
+                                        '/SandboxStore/IndexFile' : os.path.join(workdir, 'index.json')})
+        dirac = FakeDirac(backend)
+        shipped = 0
+        start = time.time()
+        for index in xrange(nbjobs):
+            app = GenericApplication()
+            app.setScript("hello.sh")
+            job = backend.getUserJob()
+            job.append(app)
+            job.setInputSandbox(list(sandbox))
+            res = job.submit(dirac)
+            if not res['OK']:
+                gLogger.error(res['Message'])
+                exitCode = 1
+                break
+            for fileName in job.inputsandbox:
+                if not fileName.lower().startswith('lfn:'):
+                    shipped += os.path.getsize(fileName)
+        duration = time.time() - start
+        stored = len([lfn for lfn in backend.replicas.keys() if lfn.count('/SandboxStore/')])
+        gLogger.notice("Store %-5s: %d jobs in %.2f s, %.1f MB shipped, %d files stored" %
+                       (enabled, nbjobs, duration, shipped / 1048576., stored))
+        backend.cleanUp()
+    os.remove("hello.sh")
+    shutil.rmtree(workdir)
+    dexit(exitCode)
@@ -0,0 +1,39 @@
+#!/bin/env python
+'''
+Compare the throughput of the application setters using the typed decorator with the
+former way of checking the arguments, i.e. looking at the caller with inspect.stack(). Both use
+the same _checkArgs, only the way the arguments are found differs.
+
+Usage: python setter_throughput.py [number of calls]
+'''
+
+if __name__=="__main__":
+    #magic lines
+    from DIRAC.Core.Base import Script
+    Script.parseCommandLine()
+
+    from DIRAC import gLogger, S_OK, exit as dexit
+
+    from Interfaces.API.GenericApplication import GenericApplication
+
+    import sys, time, types, inspect
+
+    class InspectApplication(GenericApplication):
+        """ Setters checked like before the typed decorator
+        """
+        def setArguments(self, args):
+            self._checkArgs({ 'args': types.StringTypes }, inspect.getargvalues( inspect.stack()[ 0 ][ 0 ] )[ 3 ])
+            self.Arguments = args
+            return S_OK()
+
+    nbcalls = 100000
+    if len(sys.argv) > 1:
+        nbcalls = int(sys.argv[1])
+
+    for app in (InspectApplication(), GenericApplication()):
+        start = time.time()
+        for _ in xrange(nbcalls):
+            app.setArguments("some arguments")
+        duration = time.time() - start
+        gLogger.notice("%-20s: %.0f calls/s" % (app.__class__.__name__, nbcalls / duration))
+    dexit(0)
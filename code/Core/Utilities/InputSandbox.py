@@ -0,0 +1,38 @@
+'''
+Input sandbox list handling: flattening and de-duplication in a single pass.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from DIRAC import S_OK, S_ERROR
+
+def flattenInputSandbox(items, seen = None):
+    """ Flatten a list of files that can contain lists of files, dropping the duplicates.
+
+    >>> flattenInputSandbox(['a', ['b', 'a'], 'c'])['Value']
+    {'Files': ['a', 'b', 'c'], 'ListOfLists': True}
+
+    @param items: files or lists of files
+    @param seen: set of files already in the sandbox, updated with the new ones
+    @return: S_OK({'Files': new files in order, 'ListOfLists': True if a list of lists was found}) or
+      S_ERROR if there are lists of lists of lists
+    """
+    if seen is None:
+        seen = set()
+    files = []
+    foundList = False
+    for item in items:
+        if type(item) == type([]):
+            foundList = True
+            for subitem in item:
+                if type(subitem) == type([]):
+                    return S_ERROR("Too many lists of lists in the input sandbox, please fix!")
+                if not subitem in seen:
+                    seen.add(subitem)
+                    files.append(subitem)
+        elif not item in seen:
+            seen.add(item)
+            files.append(item)
+    return S_OK({'Files' : files, 'ListOfLists' : foundList})
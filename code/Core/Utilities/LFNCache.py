@@ -0,0 +1,72 @@
+'''
+Cache of the LFNs known to exist in the catalog, with a time to live and LRU eviction.
+
+Used by L{Dirac.checkInputSandboxLFNs} so that the LFNs shipped with many jobs are looked up once.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from collections import OrderedDict
+import time, threading
+
+class LFNCache(object):
+    """ Remember for ttl seconds that an LFN exists, keeping at most maxSize LFNs
+    """
+    def __init__(self, maxSize = 10000, ttl = 600):
+        """
+        @param maxSize: maximum number of LFNs kept, the least recently used are dropped first
+        @param ttl: seconds during which an LFN is considered to exist
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lfns = OrderedDict()
+        self._lock = threading.Lock()
+
+    def exists(self, lfn):
+        """ Check if the LFN is known to exist. Counts a hit or a miss.
+        """
+        self._lock.acquire()
+        try:
+            timestamp = self._lfns.pop(lfn, None)
+            if timestamp is None or time.time() - timestamp >= self.ttl:
+                self.misses += 1
+                return False
+            self._lfns[lfn] = timestamp
+            self.hits += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def add(self, lfns):
+        """ Record that the LFNs exist
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            for lfn in lfns:
+                self._lfns.pop(lfn, None)
+                self._lfns[lfn] = now
+            while len(self._lfns) > self.maxSize:
+                self._lfns.popitem(last = False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Forget all the LFNs, and reset the counters
+        """
+        self._lock.acquire()
+        try:
+            self._lfns.clear()
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self._lock.release()
+
+    def getStats(self):
+        """ Return the hit and miss counters and the number of cached LFNs
+        """
+        return {'Hits' : self.hits, 'Misses' : self.misses, 'Size' : len(self._lfns)}
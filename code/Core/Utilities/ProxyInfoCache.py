@@ -0,0 +1,96 @@
+'''
+Process wide cache of the proxy information.
+
+Parsing the proxy and its certificate chain is expensive, and the same proxy is looked at for every
+job object and every workflow module. The information is cached per proxy file and modification time,
+for at most TTL seconds.
+
+>>> from Core.Utilities.ProxyInfoCache import getProxyInfo, invalidateProxyInfo
+>>> res = getProxyInfo()
+
+The returned dictionaries are shared: do not modify them.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+import os, time, threading
+
+class ProxyInfoCache(object):
+    """ Cache the results of the ProxyInfo functions, keyed on the proxy file path and modification time
+    """
+    def __init__(self, ttl = 300):
+        """
+        @param ttl: seconds during which a result is reused
+        """
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _getKey(self, functionName):
+        """ The proxy file and its modification time identify the proxy
+        """
+        #The security modules are heavy, they are only imported when the proxy is needed
+        from DIRAC.Core.Security.Locations import getProxyLocation
+        proxyFile = getProxyLocation()
+        mtime = None
+        if proxyFile:
+            try:
+                mtime = os.stat(proxyFile).st_mtime
+            except OSError:
+                proxyFile = None
+        return (functionName, proxyFile, mtime)
+
+    def _get(self, functionName):
+        """ Return the cached result of ProxyInfo.<functionName>(), calling it if needed
+        """
+        key = self._getKey(functionName)
+        self._lock.acquire()
+        try:
+            if self._cache.has_key(key):
+                timestamp, result = self._cache[key]
+                if time.time() - timestamp < self.ttl:
+                    return result
+            from DIRAC.Core.Security import ProxyInfo
+            result = getattr(ProxyInfo, functionName)()
+            self._cache[key] = (time.time(), result)
+            return result
+        finally:
+            self._lock.release()
+
+    def getProxyInfo(self):
+        """ Cached L{DIRAC.Core.Security.ProxyInfo.getProxyInfo}
+        """
+        return self._get('getProxyInfo')
+
+    def getProxyInfoAsString(self):
+        """ Cached L{DIRAC.Core.Security.ProxyInfo.getProxyInfoAsString}
+        """
+        return self._get('getProxyInfoAsString')
+
+    def invalidate(self):
+        """ Forget all the cached information, e.g. after a new proxy was created in place
+        """
+        self._lock.acquire()
+        try:
+            self._cache.clear()
+        finally:
+            self._lock.release()
+
+gProxyInfoCache = ProxyInfoCache()
+
+def getProxyInfo():
+    """ Proxy information of the current proxy, from the process wide cache
+    """
+    return gProxyInfoCache.getProxyInfo()
+
+def getProxyInfoAsString():
+    """ Proxy information of the current proxy as a string, from the process wide cache
+    """
+    return gProxyInfoCache.getProxyInfoAsString()
+
+def invalidateProxyInfo():
+    """ Empty the process wide cache
+    """
+    gProxyInfoCache.invalidate()
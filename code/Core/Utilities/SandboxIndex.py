@@ -0,0 +1,180 @@
+'''
+Local on-disk index of the input sandbox files already stored on a storage element.
+
+Files are identified by their content: the SHA1 digest of the file followed by its name, e.g.
+"3f786850e387550fdab836ed7e6dc881de23001b/lib.tar.gz". The index remembers
+  - the digest of the local files, per path, size and modification time, so unchanged files are not read again
+  - the LFN under which each content was stored, for at most TTL seconds
+
+Both tables keep at most maxEntries entries, the least recently used are dropped first.
+
+>>> index = SandboxIndex('/home/user/.sandboxindex.json')
+>>> key = index.getKey('lib.tar.gz')['Value']
+>>> if not index.getLFN(key):
+...     index.addLFN(key, '/vo/user/u/user/SandboxStore/%s' % key)
+>>> index.save()
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from DIRAC import S_OK, S_ERROR
+
+from collections import OrderedDict
+import os, time, json, hashlib, tempfile, threading
+
+#: Size of the reads when hashing
+BLOCK_SIZE = 4194304
+
+class SandboxIndex(object):
+    """ Content keys of local files and LFNs of the stored contents, persisted in a JSON file
+    """
+    def __init__(self, indexFile, maxEntries = 10000, ttl = 86400):
+        """
+        @param indexFile: path of the JSON file, created on L{save}
+        @param maxEntries: maximum number of files and of stored contents remembered
+        @param ttl: seconds during which a stored content is assumed to still be on the storage
+        """
+        self.indexFile = indexFile
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self._files = OrderedDict()
+        self._stored = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """ Read the index file, an unreadable index is simply ignored
+        """
+        if not os.path.exists(self.indexFile):
+            return
+        try:
+            indexFile = open(self.indexFile)
+            try:
+                content = json.load(indexFile)
+            finally:
+                indexFile.close()
+            self._files = OrderedDict(content['Files'])
+            self._stored = OrderedDict(content['Stored'])
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            self._files = OrderedDict()
+            self._stored = OrderedDict()
+
+    def save(self):
+        """ Write the index, replacing the file atomically so concurrent submissions never read half of it
+        @return: S_OK() or S_ERROR()
+        """
+        self._lock.acquire()
+        try:
+            content = json.dumps({'Files' : self._files.items(), 'Stored' : self._stored.items()})
+        finally:
+            self._lock.release()
+        try:
+            directory = os.path.dirname(os.path.abspath(self.indexFile))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, tmpName = tempfile.mkstemp(prefix = '.sandboxindex', dir = directory)
+            os.write(handle, content)
+            os.close(handle)
+            os.rename(tmpName, self.indexFile)
+        except EnvironmentError, why:
+            return S_ERROR("Failed to write the sandbox index %s: %s" % (self.indexFile, str(why)))
+        return S_OK()
+
+    def _evict(self, table):
+        """ Drop the least recently used entries beyond maxEntries
+        """
+        while len(table) > self.maxEntries:
+            table.popitem(last = False)
+
+    def getKey(self, fileName):
+        """ Content key of a local file: its SHA1 digest and its name. The file is only read if it changed.
+        @param fileName: path of the local file
+        @return: S_OK(key) or S_ERROR()
+        """
+        path = os.path.realpath(fileName)
+        try:
+            stat = os.stat(path)
+        except OSError, why:
+            return S_ERROR("Failed to access %s: %s" % (fileName, str(why)))
+        self._lock.acquire()
+        try:
+            entry = self._files.pop(path, None)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+                self._files[path] = entry
+                return S_OK("%s/%s" % (entry[2], os.path.basename(fileName)))
+        finally:
+            self._lock.release()
+
+        sha1 = hashlib.sha1()
+        try:
+            inputFile = open(path, 'rb')
+            try:
+                while True:
+                    data = inputFile.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    sha1.update(data)
+            finally:
+                inputFile.close()
+        except EnvironmentError, why:
+            return S_ERROR("Failed to read %s: %s" % (fileName, str(why)))
+        digest = sha1.hexdigest()
+        self._lock.acquire()
+        try:
+            self._files[path] = [stat.st_size, stat.st_mtime, digest]
+            self._evict(self._files)
+        finally:
+            self._lock.release()
+        return S_OK("%s/%s" % (digest, os.path.basename(fileName)))
+
+    def getLFN(self, key):
+        """ LFN of a stored content, if it was stored less than TTL seconds ago
+        @param key: content key from L{getKey}
+        @return: LFN or None
+        """
+        self._lock.acquire()
+        try:
+            entry = self._stored.pop(key, None)
+            if entry is None or time.time() - entry[1] >= self.ttl:
+                return None
+            self._stored[key] = entry
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def addLFN(self, key, lfn):
+        """ Record that a content is stored under lfn
+        """
+        self._lock.acquire()
+        try:
+            self._stored.pop(key, None)
+            self._stored[key] = [lfn, time.time()]
+            self._evict(self._stored)
+        finally:
+            self._lock.release()
+
+    def removeLFN(self, key):
+        """ Forget a stored content, e.g. when it was removed from the storage
+        """
+        self._lock.acquire()
+        try:
+            self._stored.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Forget everything, the index file is only changed on L{save}
+        """
+        self._lock.acquire()
+        try:
+            self._files.clear()
+            self._stored.clear()
+        finally:
+            self._lock.release()
+
+    def getStats(self):
+        """ Number of files and stored contents in the index
+        """
+        return {'Files' : len(self._files), 'Stored' : len(self._stored)}
@@ -0,0 +1,58 @@
+'''
+Run a function on many items with a bounded number of threads.
+
+Meant for I/O bound work: file reads, checksums, transfers, service calls.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from DIRAC import S_ERROR
+import threading, Queue
+
+def threadedMap(function, items, maxThreads = 4):
+    """ Call function(item) for every item, using at most maxThreads threads.
+
+    The function should return S_OK/S_ERROR. An exception raised by the function is converted to S_ERROR.
+
+    @param function: callable taking one item
+    @param items: list of items
+    @param maxThreads: maximum number of threads to run concurrently
+    @return: list of the results, in the same order as the items
+    """
+    items = list(items)
+    results = [None] * len(items)
+    nbThreads = min(max(int(maxThreads), 1), len(items))
+    if nbThreads < 2:
+        for index, item in enumerate(items):
+            results[index] = _call(function, item)
+        return results
+
+    queue = Queue.Queue()
+    for index, item in enumerate(items):
+        queue.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            results[index] = _call(function, item)
+
+    threads = [threading.Thread(target = worker) for _ in range(nbThreads)]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def _call(function, item):
+    """ Call the function, converting exceptions to S_ERROR
+    """
+    try:
+        return function(item)
+    except Exception, x:
+        return S_ERROR("%s: %s" % (x.__class__.__name__, str(x)))
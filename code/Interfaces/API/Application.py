@@ -7,8 +7,8 @@ Base application class. All applications inherit this class.
 @author: Stephane Poss
 
 '''
-from DIRAC.Core.Workflow.Module                     import ModuleDefinition
-from DIRAC.Core.Workflow.Parameter                  import Parameter
+#The DIRAC Workflow classes are only imported when the workflow is built, to keep this module fast to import
+from Interfaces.API.ArgumentChecks                  import typed, checkArgs
 
 from DIRAC import S_OK, S_ERROR, gLogger
 import inspect, sys, types, os, urllib
@@ -19,15 +19,31 @@ __RCSID__ = "$Id: $"
 class Application(object):
     """ General application definition. Any new application should inherit from this class.
     """
-    #need to define slots
-    ## __slots__ = []
+    #The members are stored in slots: many applications are held in memory for parametric jobs.
+    #Sub classes can add their own slots, or not define any and use the __dict__.
+    __slots__ = ['appname', 'Version', 'SteeringFile', 'inputSB', 'InputFile', 'OutputFile', 'OutputPath',
+                 'OutputSE', '_listofoutput', 'LogFile', 'detectortype', 'datatype', 'ExtraCLIArguments',
+                 'willBeCut', 'Debug', 'prodparameters', 'accountInProduction', '_modulename',
+                 '_moduledescription', '_importLocation', '_systemconfig', '_job', '_jobapps', '_jobsteps',
+                 '_jobtype', '_inputapp', '_linkedidx', '_inputappstep', '_streamoutput', 'addedtojob', '_log',
+                 '_errorDict']
+    
+    #This is used to filter out the members that should not be set when using a dict as input.
+    #Sub classes extend it with Application._paramsToExclude.union([...])
+    _paramsToExclude = frozenset(["_log", "_errorDict", "addedtojob",
+                                  "_inputappstep", "_linkedidx", "_inputapp", "_streamoutput", "_jobtype",
+                                  "_jobsteps", "_jobapps", "_job", "_systemconfig", "_importLocation",
+                                  "_moduledescription", "_modulename", "prodparameters",
+                                  "datatype", "detectortype", "_listofoutput", "inputSB",
+                                  "appname", 'accountInProduction', 'OutputPath'])
+    
     def __init__(self, paramdict = None):
         """ Can define the full application by passing a dictionary in the constructor.
         
         >>> app = Application({"Name":"marlin","Version":"v0111Prod",
         ...                    "SteeringFile":"My_file.xml","NbEvts":1000})
         
-        @param paramdict: Dictionary of parameters that can be set. Will throw an exception if one of them does not exist.
+        @param paramdict: Dictionary of parameters that can be set. Reports an error if one of them does not have a setter.
         @type paramdict: dict
         
         """
@@ -85,6 +101,8 @@ class Application(object):
         self._linkedidx = None
         #Needed to link the parameters.
         self._inputappstep = None
+        #The OutputFile is streamed to the application getting its input from this one, see getInputFromApp
+        self._streamoutput = False
         
         #flag set to true in Job.append
         self.addedtojob = False
@@ -92,14 +110,6 @@ class Application(object):
         self._log = gLogger.getSubLogger(self.__class__.__name__)
         self._errorDict = {}
         
-        #This is used to filter out the members that should not be set when using a dict as input
-        self._paramsToExclude = ['_paramsToExclude', "_log", "_errorDict", "addedtojob",
-                                 "_inputappstep", "_linkedidx", "_inputapp", "_jobtype",
-                                 "_jobsteps", "_jobapps", "_job", "_systemconfig", "_importLocation",
-                                 "_moduledescription", "_modulename", "prodparameters",
-                                 "datatype", "detectortype", "_listofoutput", "inputSB",
-                                 "appname", 'accountInProduction', 'OutputPath']
-        
         ### Next is to use the setattr method.
         self._setparams(paramdict)
     
@@ -114,19 +124,73 @@ class Application(object):
         """
         if not params:
             return S_OK()
+        setters = self._getSetters()
+        failed = []
+        unknown = sorted([param for param in params.keys() if not setters.has_key(param)])
+        if unknown:
+            message = "The %s class does not have the methods %s" % (self.__class__.__name__, 
+                                                                    ", ".join(["set%s" % param for param in unknown]))
+            failed.append(message)
+            self._reportError(message, self.__class__.__name__, **dict([(param, params[param]) for param in unknown]))
         for param, value in params.items():
-            if type(value) in types.StringTypes:
-                value = "'%s'" % value
-            try:
-                exec "self.set%s(%s)" % (param, str(value))
-            except:
-                self._log.error("The %s class does not have a set%s method." % (self.__class__.__name__, param))
+            if param in unknown:
+                continue
+            res = setters[param](self, value)
+            if res and not res['OK']:
+                failed.append(res['Message'])
+                #So that the job checks fail, unless the setter already reported it
+                if not [errors for errors in self._errorDict.values() if res['Message'] in errors]:
+                    self._reportError(res['Message'], self.__class__.__name__, **{param : value})
+        if failed:
+            return S_ERROR("\n".join(failed))
         return S_OK()  
     
+    def _getMembers(self):
+        """ Return the dictionary of all the members set, whether they are in slots or in the __dict__
+        """
+        members = {}
+        for name in self._getSlotNames():
+            if hasattr(self, name):
+                members[name] = getattr(self, name)
+        members.update(getattr(self, '__dict__', {}))
+        return members
+    
+    @classmethod
+    def _getSlotNames(cls):
+        """ Return the names of the slots defined by the class and all its parents.
+        
+        Stored in the class the first time it's needed
+        """
+        if not cls.__dict__.has_key('_slotnames'):
+            slotnames = []
+            for klass in cls.__mro__:
+                for name in klass.__dict__.get('__slots__', []):
+                    if not name in slotnames and not name in ('__dict__', '__weakref__'):
+                        slotnames.append(name)
+            cls._slotnames = slotnames
+        return cls._slotnames
+    
+    @classmethod
+    def _getSetters(cls):
+        """ Return the dictionary of the setters of the class: {"Name": setName, ...}
+        
+        Built the first time a class is given a parameter dictionary, then stored in the class.
+        """
+        if not cls.__dict__.has_key('_setters'):
+            setters = {}
+            for attr in dir(cls):
+                if not attr.startswith("set") or len(attr) == 3:
+                    continue
+                method = getattr(cls, attr)
+                if callable(method):
+                    setters[attr[3:]] = method
+            cls._setters = setters
+        return cls._setters
+    
     def _getParamsDict(self):
         """ Return dictionary that can be used to build a new application based on the current
         """
-        curdict = self.__dict__
+        curdict = self._getMembers()
         pdict = {}
         for key, val in curdict.items():
             if not key in self._paramsToExclude:
@@ -134,49 +198,50 @@ class Application(object):
                     pdict[key] = val
         return S_OK(pdict)
       
+    @typed(name = types.StringTypes)
     def setName(self, name):
         """ Define name of application
         
         @param name: Name of the application. Normally, every application defines its own, so no need to call that one
         @type name: string 
         """
-        self._checkArgs({ 'name' : types.StringTypes } )
         self.appname = name
         return S_OK()  
       
+    @typed(version = types.StringTypes)
     def setVersion(self, version):
         """ Define version to use
         
         @param version: Version of the application to use
         @type version: string
         """
-        self._checkArgs({ 'version' : types.StringTypes } )
         self.Version = version
         return S_OK()  
       
+    @typed(steeringfile = types.StringTypes)
     def setSteeringFile(self, steeringfile):
         """ Set the steering file, and add it to sandbox
         
         @param steeringfile: Steering file to use. 
         @type steeringfile: string
         """
-        self._checkArgs({ 'steeringfile' : types.StringTypes } )
         self.SteeringFile = steeringfile
         if os.path.exists(steeringfile) or steeringfile.lower().count("lfn:"):
             self.inputSB.append(steeringfile) 
         return S_OK()  
       
+    @typed(logfile = types.StringTypes)
     def setLogFile(self, logfile):
         """ Define application log file
         
         @param logfile: Log file to use. Set by default if not set.
         @type logfile: string
         """
-        self._checkArgs({ 'logfile' : types.StringTypes } )
         self.LogFile = logfile
         return S_OK()  
     
       
+    @typed(ofile = types.StringTypes, path = types.StringTypes)
     def setOutputFile(self, ofile, path = None):
         """ Set the output file
         
@@ -185,8 +250,6 @@ class Application(object):
         @param path: Set the output path for the output file to go. Will not do anything in a UserJob. Use setOutputData of the job for that functionality.
         @type path: string
         """
-        self._checkArgs({ 'ofile' : types.StringTypes } )
-        
         self.OutputFile = ofile
         self.prodparameters[ofile] = {}
         if self.detectortype:
@@ -195,11 +258,11 @@ class Application(object):
             self.prodparameters[ofile]['datatype'] = self.datatype
         
         if path:
-            self._checkArgs({ 'path' : types.StringTypes } )
             self.OutputPath = path
           
         return S_OK()
     
+    @typed(se = types.StringTypes)
     def setOutputSE(self, se):
         """ Set the output storage element for all files produced by this application.
         
@@ -207,7 +270,6 @@ class Application(object):
         @type se: string
         
         """
-        self._checkArgs({ 'se' : types.StringTypes } )
         self.OutputSE = se
         return S_OK()
     
@@ -230,19 +292,30 @@ class Application(object):
         
         return S_OK()
     
-    def getInputFromApp(self, application):
+    @typed(stream = types.BooleanType)
+    def getInputFromApp(self, application, stream = False):
         """ Called to link applications
         
         >>> first_app = MyApp()
         >>> second_app = MyOtherApp()
         >>> second_app.getInputFromApp(first_app)
         
+        With stream = True, both applications run at the same time: the output file of the first one is a named 
+        pipe read by the second one, so it is never stored on disk. It must be read only once, by this application, 
+        and only applications running a script (GenericApplication) can stream their output. 
+        If either application fails, the other one is stopped.
+        
         @param application: Application to link against.
         @type application: application
+        @param stream: stream the output of application to this one
+        @type stream: bool
         """
         self._inputapp.append(application)
+        if stream:
+            application._streamoutput = True
         return S_OK()  
     
+    @typed(debug = types.BooleanType)
     def setDebug(self, debug = True):
         """ Set the application to debug mode
         
@@ -252,14 +325,13 @@ class Application(object):
         @param debug: Set the application to debug mode. Default is True when called. If not, then it's false.
         @type debug: bool
         """
-        self._checkArgs({ "debug": types.BooleanType} )
         self.Debug = debug
         return S_OK()
     
+    @typed(arguments = types.StringTypes)
     def setExtraCLIArguments(self, arguments):
         """ Pass any CLI argument as a string to the application
         """
-        self._checkArgs({ "arguments": types.StringTypes} )
         self.ExtraCLIArguments = arguments
         return S_OK()
         
@@ -267,7 +339,7 @@ class Application(object):
         """ Method to list attributes for users. Doesn't list any private or semi-private attributes
         """
         self._log.notice('Attribute list :')
-        for key, val in self.__dict__.items():
+        for key, val in self._getMembers().items():
             if key not in self._paramsToExclude:
                 if not val:
                     val = "Not defined"
@@ -325,6 +397,7 @@ class Application(object):
     def _createModuleDefinition(self):
         """ Create Module definition. As it's generic code, all apps will use this.
         """
+        from DIRAC.Core.Workflow.Module import ModuleDefinition
         moduledefinition = ModuleDefinition(self._modulename)
         moduledefinition.setDescription(self._moduledescription)
         body = 'from %s.%s import %s\n' % (self._importLocation, self._modulename, self._modulename)
@@ -337,6 +410,7 @@ class Application(object):
         
         The UserJobFinalization only runs last. It's called every step, but is running only if last.
         """
+        from DIRAC.Core.Workflow.Module import ModuleDefinition
         moduledefinition = ModuleDefinition('UserJobFinalization')
         moduledefinition.setDescription('Uploads user output data files with specific policies.')
         body = 'from %s.%s import %s\n' % (self._importLocation, 'UserJobFinalization', 'UserJobFinalization')
@@ -346,6 +420,7 @@ class Application(object):
     def _getComputeOutputDataListModule(self):
         """ This is separated from the applications as this is used in production jobs only.
         """
+        from DIRAC.Core.Workflow.Module import ModuleDefinition
         moduledefinition = ModuleDefinition("ComputeOutputDataList")
         moduledefinition.setDescription("Compute the output data list to be treated by the last finalization")
         body = 'from %s.%s import %s\n' % (self._importLocation, "ComputeOutputDataList", "ComputeOutputDataList" )
@@ -405,6 +480,10 @@ class Application(object):
                     question must be passed to job.append() before.")
                 else:
                     self._linkedidx = self._jobapps.index(app)
+                if app._streamoutput and not app.OutputFile:
+                    return S_ERROR("%s streams its output: its output file must be defined" % app.appname)
+                if app._streamoutput and app._modulename != "ApplicationScript":
+                    return S_ERROR("%s cannot stream its output, only scripts can" % app.appname)
                 
         return S_OK()
     
@@ -412,6 +491,7 @@ class Application(object):
         """ Add to step the default parameters: appname, version, steeringfile, (nbevts, Energy), LogFile, InputFile, 
         OutputFile, OutputPath
         """
+        from DIRAC.Core.Workflow.Parameter import Parameter
         stepdefinition.addParameter(Parameter("applicationName",    "", "string", "", "", False, False, 
                                               "Application Name"))
         stepdefinition.addParameter(Parameter("applicationVersion", "", "string", "", "", False, False, 
@@ -420,6 +500,8 @@ class Application(object):
         stepdefinition.addParameter(Parameter("applicationLog",     "", "string", "", "", False, False, "Log File"))
         stepdefinition.addParameter(Parameter("ExtraCLIArguments",     "", "string", "", "", False, False, "Extra CLI arguments"))
         stepdefinition.addParameter(Parameter("InputFile",          "", "string", "", "",  True, False, "Input File"))
+        stepdefinition.addParameter(Parameter("StreamOutput",    False,   "bool", "", "", False, False, 
+                                              "Stream the Output File to the next application"))
         
         if len(self.OutputFile):
             stepdefinition.addParameter(Parameter("OutputFile",       "", "string", "", "", False,  False, "Output File"))
@@ -456,6 +538,7 @@ class Application(object):
         
         if len(self.OutputFile):  
             stepinstance.setValue("OutputFile",       self.OutputFile)
+        stepinstance.setValue("StreamOutput",       self._streamoutput)
 
         stepinstance.setValue("OutputPath",         self.OutputPath)
         stepinstance.setValue("OutputSE",           self.OutputSE)
@@ -517,35 +600,28 @@ class Application(object):
         """
         self.addedtojob = True
         
-    def _checkArgs( self, argNamesAndTypes ):
+    def _checkArgs( self, argNamesAndTypes, args = None ):
         """ Private method to check the validity of the parameters
-        """
         
-        # inspect.stack()[1][0] returns the frame object ([0]) of the caller
-        # function (stack()[1]).
-        # The frame object is required for getargvalues. Getargvalues returns
-        # a tuple with four items. The fourth item ([3]) contains the local
-        # variables in a dict.
-        
-        args = inspect.getargvalues( inspect.stack()[ 1 ][ 0 ] )[ 3 ]
-        
-        #
+        Called by the L{typed} decorator with the arguments of the decorated method. When called without args, 
+        the arguments are taken from the frame of the calling method. The checks are done by 
+        L{ArgumentChecks.checkArgs}, the errors are reported from here.
+        """
         
-        for argName, argType in argNamesAndTypes.iteritems():
+        if args is None:
+            # sys._getframe(1) returns the frame object of the caller function,
+            # without resolving the source of the whole stack like inspect.stack().
+            # The frame object is required for getargvalues. Getargvalues returns
+            # a tuple with four items. The fourth item ([3]) contains the local
+            # variables in a dict.
             
-            if not args.has_key(argName):
-                self._reportError(
-                  'Method does not contain argument \'%s\'' % argName,
-                  __name__,
-                  **self._getArgsDict( 1 )
-                )
-            
-            if not isinstance( args[argName], argType):
-                self._reportError(
-                  'Argument \'%s\' is not of type %s' % ( argName, argType ),
-                  __name__,
-                  **self._getArgsDict( 1 )
-                )
+            args = inspect.getargvalues( sys._getframe( 1 ) )[ 3 ]
+            reportArgs = self._getArgsDict( 1 )
+        else:
+            reportArgs = args
+        
+        for message in checkArgs( argNamesAndTypes, args ):
+            self._reportError( message, __name__, **reportArgs )
     
     def _getArgsDict( self, level = 0 ):
         """ Private method
@@ -558,7 +634,7 @@ class Application(object):
         
         #
         
-        args = inspect.getargvalues( inspect.stack()[ level ][ 0 ] )
+        args = inspect.getargvalues( sys._getframe( level ) )
         adict = {}
         
         for arg in args[0]:
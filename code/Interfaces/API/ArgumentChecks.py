@@ -0,0 +1,77 @@
+'''
+Declarative type checks of the setters arguments.
+
+>>> class MyApp(Application):
+...     @typed(energy = types.IntType)
+...     def setEnergy(self, energy):
+...         self.Energy = energy
+
+The errors found by L{checkArgs} are reported through the _checkArgs method of the instance, so they
+end up in the _errorDict exactly as when _checkArgs is called from the method body.
+
+@author: Stephane Poss
+'''
+
+import inspect
+
+__RCSID__ = "$Id: $"
+
+def checkArgs(argNamesAndTypes, args):
+    """ Check the types of the arguments of a method
+
+    @param argNamesAndTypes: argument name and type (or tuple of types) it must have
+    @type argNamesAndTypes: dict
+    @param args: argument name and value
+    @type args: dict
+    @return: list of error messages, empty if the arguments are right
+    """
+    errors = []
+    for argName, argType in argNamesAndTypes.iteritems():
+        if not args.has_key(argName):
+            errors.append('Method does not contain argument \'%s\'' % argName)
+            continue
+        if not isinstance(args[argName], argType):
+            errors.append('Argument \'%s\' is not of type %s' % (argName, argType))
+    return errors
+
+def typed(**argNamesAndTypes):
+    """ Decorator checking the types of the arguments of a method before calling it
+
+    The signature of the method is only inspected once, when decorating. Arguments that
+    have None as default value are not checked when not given.
+
+    @param argNamesAndTypes: argument name and type (or tuple of types) it must have
+    @type argNamesAndTypes: dict
+    """
+    def decorator(method):
+        argnames, varargs, _varkw, defaults = inspect.getargspec(method)
+        for argName in argNamesAndTypes:
+            if not argName in argnames:
+                raise TypeError('%s does not contain argument \'%s\'' % (method.__name__, argName))
+        argnames = argnames[1:]
+        if varargs:
+            raise TypeError('%s: cannot check methods with *%s' % (method.__name__, varargs))
+        if defaults:
+            defaults = dict(zip(argnames[-len(defaults):], defaults))
+        else:
+            defaults = {}
+        unchecked = [argName for argName, default in defaults.items() if default is None]
+
+        def wrapper(self, *args, **kwargs):
+            values = dict(defaults)
+            values.update(zip(argnames, args))
+            values.update(kwargs)
+            toCheck = argNamesAndTypes
+            for argName in unchecked:
+                if values.get(argName) is None and argName in toCheck:
+                    toCheck = dict(toCheck)
+                    del toCheck[argName]
+            self._checkArgs(toCheck, values)
+            return method(self, *args, **kwargs)
+
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        wrapper.__module__ = method.__module__
+        wrapper.argTypes = argNamesAndTypes
+        return wrapper
+    return decorator
@@ -5,12 +5,15 @@ API to use to submit jobs in the Ext VO
 
 @author: Stephane Poss
 """
+#The base class is needed to define Dirac, it cannot be imported later
 from DIRAC.Interfaces.API.Dirac                            import Dirac as dapi
-from DIRAC.Core.Utilities.List                             import sortList
-from DIRAC.ConfigurationSystem.Client.Helpers.Operations   import Operations
+from Core.Utilities.LFNCache                               import LFNCache
+from Core.Utilities.ThreadedMap                            import threadedMap
+from Core.Utilities.SandboxIndex                           import SandboxIndex
+from Core.Utilities.ProxyInfoCache                         import getProxyInfo
 
 from DIRAC import S_ERROR, S_OK, gLogger
-import string
+import string, os, copy
 
 __RCSID__ = "$Id: $"
 
@@ -27,10 +30,25 @@ class Dirac(dapi):
         #self.dirac = Dirac(WithRepo=WithRepo, RepoLocation=RepoLocation)
         super(Dirac, self).__init__(withRepo, repoLocation )
         #Dirac.__init__(self, withRepo = withRepo, repoLocation = repoLocation)
+        #Imported here, to keep this module fast to import
+        from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
+        self._initialize(Operations())
+    
+    def _initialize(self, ops):
+        """ Set the state of this API, on top of the one of the DIRAC API
+        @param ops: Operations helper used to read the configuration
+        """
         self.log = gLogger
         self.software_versions = {}
         self.checked = False
-        self.ops = Operations()
+        self.ops = ops
+        #Job for which the checks were already done in submitMany
+        self._bulkjob = None
+        #LFNs of the input sandboxes already found in the catalog
+        self.lfnCache = LFNCache(maxSize = self.ops.getValue('/LFNCache/MaxSize', 10000),
+                                 ttl = self.ops.getValue('/LFNCache/TTL', 600))
+        #Index of the input sandbox files already stored, created on first use by _getSandboxIndex
+        self.sandboxIndex = None
           
     def preSubmissionChecks(self, job, mode = None):
         """Overridden method from DIRAC.Interfaces.API.Dirac
@@ -45,7 +63,17 @@ class Dirac(dapi):
         if not job.oktosubmit:
             self.log.error('You should use job.submit(dirac)')
             return S_ERROR("You should use job.submit(dirac)")
-        res = self._do_check(job)
+        if job is self._bulkjob:
+            #Already checked in submitMany, only the per job parameters changed since
+            return S_OK()
+        return self._checkAndConfirm(job)
+    
+    def _checkAndConfirm(self, job, checkLFNs = True):
+        """ Run L{_do_check} and ask the user to confirm the first submission
+        @param checkLFNs: also check the LFNs of the input sandbox
+        @return: S_OK() or S_ERROR()
+        """
+        res = self._do_check(job, checkLFNs)
         if not res['OK']:
             return res
         if not self.checked:
@@ -55,6 +83,61 @@ class Dirac(dapi):
             self.checked = True
         return S_OK()
       
+    def submitMany(self, job, paramSets, mode = 'wms'):
+        """Submit the same job several times, changing only the parameters given in paramSets
+        
+        The checks of L{preSubmissionChecks} are done once for all the jobs: the output data of every job is 
+        checked first, then the input sandbox LFNs of all the jobs with a single catalog query, before any job is 
+        submitted. The workflow of the job is restored afterwards. 
+        Use job.submitBulk(paramSets, dirac).
+        @param job: job object, with the workflow already built
+        @param paramSets: list of dictionaries with the per job parameters
+        @param mode: submission mode, passed to submit
+        
+        @return: S_OK({'Successful':{index:jobID}, 'Failed':{index:message}}) or S_ERROR()
+        """
+        if not job.oktosubmit:
+            self.log.error('You should use job.submitBulk(paramSets, dirac)')
+            return S_ERROR("You should use job.submitBulk(paramSets, dirac)")
+        res = self._checkAndConfirm(job, checkLFNs = False)
+        if not res['OK']:
+            return res
+        
+        successful = {}
+        failed = {}
+        self._bulkjob = job
+        #The variants are stamped on the workflow: keep the original one
+        workflow = copy.deepcopy(job.workflow)
+        try:
+            valid = []
+            for index, params in enumerate(paramSets):
+                res = job._setVariant(params)
+                if res['OK']:
+                    res = self._checkOutputData(job)
+                if not res['OK']:
+                    self.log.error("Job %s is not valid:" % index, res['Message'])
+                    failed[index] = res['Message']
+                    continue
+                valid.append(index)
+            #The variants share the input sandbox: one query for all of them
+            res = self.checkInputSandboxLFNsForJobs([job])
+            if not res['OK']:
+                return res
+            for index in valid:
+                res = job._setVariant(paramSets[index])
+                if res['OK']:
+                    res = self.submit(job, mode)
+                if not res['OK']:
+                    self.log.error("Failed to submit job %s:" % index, res['Message'])
+                    failed[index] = res['Message']
+                    continue
+                successful[index] = res['Value']
+        finally:
+            self._bulkjob = None
+            job.workflow = workflow
+        self.log.notice("Submitted %s jobs, %s failed" % (len(successful), len(failed)))
+        return S_OK({'Successful' : successful, 'Failed' : failed})
+    
     def checkparams(self, job):
         """Helper method
         
@@ -83,52 +166,102 @@ class Dirac(dapi):
         
         @param requestedStates: List of states requested for filtering the list
         @type requestedStates: list of strings
-        @return: list
+        @return: list, in the order of the job IDs
         """
-        llist = []
         if not self.jobRepo:
             gLogger.warn( "No repository is initialized" )
             return S_OK()
+        return list(self.iterRepositoryOutputDataLFNs(requestedStates))
+    
+    def iterRepositoryOutputDataLFNs(self, requestedStates = ['Done'], batchSize = 100, maxThreads = 10):
+        """Helper function
+        
+        Same as L{retrieveRepositoryOutputDataLFNs}, but yields the uploaded output data of the jobs as they are 
+        found, still in the order of the job IDs. The job parameters are fetched batchSize jobs at a time, with 
+        maxThreads concurrent queries. The LFNs found are stored in the repository, so only the new jobs are 
+        queried the next time.
+        
+        @param requestedStates: List of states requested for filtering the list
+        @type requestedStates: list of strings
+        @param batchSize: number of jobs queried before storing the results in the repository
+        @type batchSize: int
+        @param maxThreads: number of concurrent queries
+        @type maxThreads: int
+        """
+        if not self.jobRepo:
+            gLogger.warn( "No repository is initialized" )
+            return
         jobs = self.jobRepo.readRepository()['Value']
-        for jobID in sortList( jobs.keys() ):
+        candidates = []
+        uploaded = {}
+        toquery = []
+        for jobID in sorted( jobs.keys() ):
             jobDict = jobs[jobID]
             if jobDict.has_key( 'State' ) and ( jobDict['State'] in requestedStates ):
                 if ( jobDict.has_key( 'UserOutputData' ) and ( not int( jobDict['UserOutputData'] ) ) ) or \
                 ( not jobDict.has_key( 'UserOutputData' ) ):
-                    params = self.parameters(int(jobID))
-                    if params['OK']:
-                        if params['Value'].has_key('UploadedOutputData'):
-                            lfn = params['Value']['UploadedOutputData']
-                            llist.append(lfn)
-        return llist
-    
-    def _do_check(self, job):
+                    candidates.append( jobID )
+                    if jobDict.get( 'UploadedOutputData' ):
+                        uploaded[jobID] = jobDict['UploadedOutputData']
+                    else:
+                        toquery.append( jobID )
+        
+        #The jobs are yielded in order, as soon as all the jobs before them are known
+        pending = set( toquery )
+        position = 0
+        while position < len( candidates ) and not candidates[position] in pending:
+            if uploaded.has_key( candidates[position] ):
+                yield uploaded[candidates[position]]
+            position += 1
+        for start in xrange( 0, len( toquery ), batchSize ):
+            batch = toquery[start:start + batchSize]
+            results = threadedMap( lambda jobID: self.parameters( int( jobID ) ), batch, maxThreads )
+            found = {}
+            for jobID, params in zip( batch, results ):
+                if params['OK']:
+                    if params['Value'].has_key('UploadedOutputData'):
+                        found[jobID] = {'UploadedOutputData' : params['Value']['UploadedOutputData']}
+            if found:
+                res = self.jobRepo.updateJobs( found )
+                if not res['OK']:
+                    self.log.warn( "Could not store the output data in the repository:", res['Message'] )
+            for jobID in batch:
+                pending.discard( jobID )
+                if found.has_key( jobID ):
+                    uploaded[jobID] = found[jobID]['UploadedOutputData']
+            while position < len( candidates ) and not candidates[position] in pending:
+                if uploaded.has_key( candidates[position] ):
+                    yield uploaded[candidates[position]]
+                position += 1
+    
+    def _do_check(self, job, checkLFNs = True):
         """ Main method for checks
         @param job: job object
+        @param checkLFNs: check that the LFNs of the input sandbox exist, see L{checkInputSandboxLFNsForJobs}
         @return: S_OK() or S_ERROR()
         """
         #Start by taking care of sandbox
         if hasattr(job, "inputsandbox"):
             if type( job.inputsandbox ) == list and len( job.inputsandbox ):
-                found_list = False
-                for items in job.inputsandbox:
-                    if type(items) == type([]):#We fix the SB in the case is contains a list of lists
-                        found_list = True
-                        for f in items:
-                            if type(f) == type([]):
-                                return S_ERROR("Too many lists of lists in the input sandbox, please fix!")
-                            job.inputsandbox.append(f)
-                        job.inputsandbox.remove(items)
-                resolvedFiles = job._resolveInputSandbox( job.inputsandbox )
-                if found_list:
+                #Flatten and remove the duplicates in one pass, the job could have been modified directly
+                res = job._setInputSandbox(job.inputsandbox)
+                if not res['OK']:
+                    return res
+                if res['Value']:
                     self.log.warn("Input Sandbox contains list of lists. Please avoid that.")
+                if self.ops.getValue('/SandboxStore/Enabled', False):
+                    res = self._storeInputSandbox(job)
+                    if not res['OK']:
+                        return res
+                resolvedFiles = job._resolveInputSandbox( job.inputsandbox )
                 fileList = string.join( resolvedFiles, ";" )
                 description = 'Input sandbox file list'
                 job._addParameter( job.workflow, 'InputSandbox', 'JDL', fileList, description )
               
-        res = self.checkInputSandboxLFNs(job)
-        if not res['OK']:
-            return res
+        if checkLFNs:
+            res = self.checkInputSandboxLFNs(job)
+            if not res['OK']:
+                return res
         
         #apps = job.workflow.findParameter("SoftwarePackages")
         #if apps:
@@ -140,6 +273,13 @@ class Dirac(dapi):
                 #res = self._checkapp(sysconf, app, vers)
                 #if not res['OK']:
                 #    return res
+        return self._checkOutputData(job)
+    
+    def _checkOutputData(self, job):
+        """ Check the output path and that the output data files are not in the output sandbox too
+        @param job: job object
+        @return: S_OK() or S_ERROR()
+        """
         outputpathparam = job.workflow.findParameter("UserOutputPath")
         if outputpathparam:
             outputpath = outputpathparam.getValue()
@@ -201,6 +341,23 @@ class Dirac(dapi):
         @param job: job object
         @return: S_OK() or S_ERROR()
         """
+        return self.checkInputSandboxLFNsForJobs([job])
+    
+    def checkInputSandboxLFNsForJobs(self, jobs):
+        """ Check that LFNs in the ISB of all the jobs exist in the FileCatalog, with a single query
+        @param jobs: list of job objects
+        @return: S_OK() or S_ERROR()
+        """
+        lfns = []
+        for job in jobs:
+            lfns.extend(self._getInputSandboxLFNs(job))
+        return self.checkLFNsExist(lfns)
+    
+    def _getInputSandboxLFNs(self, job):
+        """ Return the LFNs of the job input sandbox
+        @param job: job object
+        @return: list
+        """
         lfns = []
         inputsb = job.workflow.findParameter("InputSandbox")
         if inputsb:
@@ -210,14 +367,150 @@ class Dirac(dapi):
                 for f in isblist:
                     if f.lower().count('lfn:'):
                         lfns.append(f.replace('LFN:', '').replace('lfn:', ''))
-        if len(lfns):
-            res = self.getReplicas(lfns)
+        return lfns
+    
+    def checkLFNsExist(self, lfns):
+        """ Check that the LFNs have replicas. Only the LFNs not found recently are queried, in one call.
+        @param lfns: list of LFNs, can contain duplicates
+        @return: S_OK() or S_ERROR()
+        """
+        res = self._findLFNs(lfns)
+        if not res['OK']:
+            return res
+        failed = res['Value']['Missing']
+        if failed:
+            self.log.error('Failed to find replicas for the following files %s' % string.join(failed, ', '))
+            return S_ERROR('Failed to find replicas')
+        if res['Value']['Queried']:
+            self.log.info('All LFN files have replicas available')
+        return S_OK()
+    
+    def _findLFNs(self, lfns):
+        """ Find which LFNs have replicas. Only the LFNs not found recently are queried, in one call.
+        @param lfns: list of LFNs, can contain duplicates
+        @return: S_OK({'Missing': LFNs without replicas, 'Queried': number of LFNs queried}) or S_ERROR()
+        """
+        tocheck = []
+        seen = set()
+        for lfn in lfns:
+            if lfn in seen:
+                continue
+            seen.add(lfn)
+            if not self.lfnCache.exists(lfn):
+                tocheck.append(lfn)
+        missing = []
+        if len(tocheck):
+            res = self.getReplicas(tocheck)
             if not res["OK"]:
                 return S_ERROR('Could not get replicas')
-            failed = res['Value']['Failed']
-            if failed:
-                self.log.error('Failed to find replicas for the following files %s' % string.join(failed, ', '))
-                return S_ERROR('Failed to find replicas')
-            else:
-                self.log.info('All LFN files have replicas available')
+            self.lfnCache.add(res['Value']['Successful'].keys())
+            missing = [lfn for lfn in tocheck if not res['Value']['Successful'].has_key(lfn)]
+        return S_OK({'Missing' : missing, 'Queried' : len(tocheck)})
+    
+    def _getSandboxIndex(self):
+        """ The local index of the stored input sandbox files, configured in /SandboxStore
+        @return: L{SandboxIndex}
+        """
+        if self.sandboxIndex is None:
+            indexFile = self.ops.getValue('/SandboxStore/IndexFile', '')
+            if not indexFile:
+                indexFile = os.path.join(os.path.expanduser('~'), '.dirac', 'sandboxindex.json')
+            self.sandboxIndex = SandboxIndex(indexFile,
+                                             maxEntries = self.ops.getValue('/SandboxStore/MaxEntries', 10000),
+                                             ttl = self.ops.getValue('/SandboxStore/TTL', 86400))
+        return self.sandboxIndex
+    
+    def _getSandboxStorePath(self):
+        """ Base LFN of the stored input sandbox files: /vo/user/u/username/SandboxStore
+        @return: S_OK(path) or S_ERROR()
+        """
+        res = getProxyInfo()
+        if not res['OK']:
+            return res
+        if not res['Value'].has_key('username') or not res['Value'].has_key('group'):
+            return S_ERROR('Could not get username and group from proxy')
+        username = res['Value']['username']
+        from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getVOForGroup
+        vo = getVOForGroup(res['Value']['group'])
+        return S_OK('/%s/user/%s/%s/SandboxStore' % (vo, username[0], username))
+    
+    def _storeInputSandbox(self, job):
+        """ Replace the local files of the input sandbox by the LFNs of stored copies of their content
+        
+        The files are identified by their SHA1 digest and name. A content is uploaded to /SandboxStore/SE only 
+        if it is neither in the local index nor in the catalog, so the same files shipped with many jobs are 
+        uploaded once. Files smaller than /SandboxStore/MinSize stay in the sandbox, and so do the files that 
+        could not be stored: this is never a reason to fail the submission.
+        @param job: job object, its inputsandbox is modified
+        @return: S_OK()
+        """
+        index = self._getSandboxIndex()
+        minSize = self.ops.getValue('/SandboxStore/MinSize', 1048576)
+        candidates = {}
+        paths = {}
+        for position, fileName in enumerate(job.inputsandbox):
+            if fileName.lower().startswith('lfn:') or not os.path.isfile(fileName):
+                continue
+            if os.path.getsize(fileName) < minSize:
+                continue
+            res = index.getKey(fileName)
+            if not res['OK']:
+                self.log.warn('Cannot store the input sandbox file:', res['Message'])
+                continue
+            candidates[position] = res['Value']
+            paths[res['Value']] = fileName
+        if not candidates:
+            return S_OK()
+        res = self._getSandboxStorePath()
+        if not res['OK']:
+            self.log.warn('Cannot store the input sandbox files:', res['Message'])
+            return S_OK()
+        basePath = res['Value']
+        
+        #The index can be stale: its LFNs are checked with the others, in one catalog query
+        lfns = {}
+        for key in paths.keys():
+            lfns[key] = index.getLFN(key) or '%s/%s' % (basePath, key)
+        res = self._findLFNs(lfns.values())
+        if not res['OK']:
+            self.log.warn('Cannot check the stored input sandbox files:', res['Message'])
+            return S_OK()
+        missing = set(res['Value']['Missing'])
+        storageElement = self.ops.getValue('/SandboxStore/SE', '')
+        for key in paths.keys():
+            if lfns[key] not in missing:
+                index.addLFN(key, lfns[key])
+                continue
+            if index.getLFN(key):
+                self.log.verbose('%s is no longer stored, removing it from the index' % lfns[key])
+                index.removeLFN(key)
+            lfn = '%s/%s' % (basePath, key)
+            del lfns[key]
+            if not storageElement:
+                continue
+            self.log.verbose('Storing %s as %s' % (paths[key], lfn))
+            res = self.addFile(lfn, os.path.abspath(paths[key]), storageElement)
+            if not res['OK']:
+                self.log.warn('Failed to store %s, it is shipped with the job:' % paths[key], res['Message'])
+                continue
+            index.addLFN(key, lfn)
+            lfns[key] = lfn
+        
+        self.lfnCache.add(lfns.values())
+        for position, key in candidates.items():
+            if lfns.has_key(key):
+                job.inputsandbox[position] = 'LFN:%s' % lfns[key]
+        #Different local files with the same content and name now point to the same LFN
+        res = job._setInputSandbox(job.inputsandbox)
+        if not res['OK']:
+            self.log.warn('Cannot update the input sandbox:', res['Message'])
+        res = index.save()
+        if not res['OK']:
+            self.log.warn(res['Message'])
         return S_OK()
+    
+    def getLFNCacheStats(self):
+        """ Hits and misses of the LFN cache used by L{checkLFNsExist}
+        @return: S_OK({'Hits':int, 'Misses':int, 'Size':int})
+        """
+        return S_OK(self.lfnCache.getStats())
@@ -1,9 +1,13 @@
 from Interfaces.API.Application                     import Application
-from DIRAC.Core.Workflow.Parameter                  import Parameter
+from Interfaces.API.ArgumentChecks                  import typed
 from DIRAC import S_OK, S_ERROR
 
 
-import types, os
+import types, os, json
+
+#: Files with the resources used by the scripts, written by the ApplicationScript module when asked with
+#: L{GenericApplication.setReportResources}
+RESOURCES_FILES = '*_resources.json'
 
 
 class GenericApplication(Application):
@@ -18,11 +22,20 @@ class GenericApplication(Application):
 
     In case you also use the setExtraCLIArguments method, whatever you put
     in there will be added at the end of the CLI, i.e. after the Arguments
+
+    To run the script once per value, several at a time on the cores of the worker node:
+
+    >>> ga.setParametricValues(["1", "2", "3", "4"])
     """
+    __slots__ = ['Script', 'Arguments', 'dependencies', 'ParametricValues', 'NumberOfProcesses', 'ReportResources']
+    
     def __init__(self, paramdict=None):
         self.Script = None
         self.Arguments = ''
         self.dependencies = {}
+        self.ParametricValues = []
+        self.NumberOfProcesses = 0
+        self.ReportResources = False
         ### The Application init has to come last as if not the passed
         ### parameters are overwritten by the defaults.
         super(GenericApplication, self).__init__(paramdict)
@@ -35,6 +48,7 @@ class GenericApplication(Application):
     ###### Syntax is rigid: all accessors start with 'set' then the member name starting with a Capital letter
     ###### This is required due to the possibility to define any application in one line passing a dict.
     ###### See the Application class for details.
+    @typed(script = types.StringTypes)
     def setScript(self, script):
         """ Define script to use
 
@@ -42,16 +56,13 @@ class GenericApplication(Application):
         Can be local file or LFN.
         @type script: string
         """
-        #Check that the specified parameter has the right type. Not quite the right way to do this, but lightweight.
-        self._checkArgs({
-            'script': types.StringTypes
-          })
         if os.path.exists(script) or script.lower().count("lfn:"): # add the file to the application sandbox
             self.inputSB.append(script)
             
         self.Script = script
         return S_OK()
 
+    @typed(args = types.StringTypes)
     def setArguments(self, args):
         """ Optional: Define the arguments of the script
 
@@ -59,12 +70,10 @@ class GenericApplication(Application):
         @type args: string
 
         """
-        self._checkArgs({
-            'args': types.StringTypes
-          })
         self.Arguments = args
         return S_OK()
 
+    @typed(appdict = types.DictType)
     def setDependency(self, appdict):
         """ Define list of application you need
 
@@ -74,14 +83,49 @@ class GenericApplication(Application):
         @type appdict: dict
 
         """
-        #check that appdict is a python dictionary
-        self._checkArgs({
-            'appdict': types.DictType
-          })
-
         self.dependencies.update(appdict)
         return S_OK()
 
+    @typed(values = (types.ListType, types.TupleType))
+    def setParametricValues(self, values):
+        """ Optional: Run the script once per value, appended to its arguments. The runs share the step and 
+        run at the same time, as many as the cores allocated to the job (see L{setNumberOfProcesses}).
+
+        Run i (starting at 0) has its own log and the files it creates get the suffix _i: 
+        out.slcio becomes out_i.slcio. The step fails if any run fails.
+
+        >>> app.setParametricValues(["--seed 1", "--seed 2"])
+
+        @param values: arguments of every run
+        @type values: list of strings
+        """
+        self.ParametricValues = [str(value) for value in values]
+        return S_OK()
+
+    @typed(processes = types.IntType)
+    def setNumberOfProcesses(self, processes):
+        """ Optional: Maximum number of runs of L{setParametricValues} at the same time. By default, and in any
+        case at most, the number of cores allocated to the job.
+
+        @param processes: number of runs at the same time
+        @type processes: int
+        """
+        if processes < 1:
+            return self._reportError("The number of processes must be positive", __name__, processes = processes)
+        self.NumberOfProcesses = processes
+        return S_OK()
+
+    @typed(report = types.BooleanType)
+    def setReportResources(self, report):
+        """ Optional: Get the resources used by the script (CPU, memory, I/O) in the output sandbox, as
+        <step>_resources.json. They are set as job parameter in any case.
+
+        @param report: whether to write the resources file
+        @type report: bool
+        """
+        self.ReportResources = report
+        return S_OK()
+
     ##### The * symbol
 
     ##### Below are the internal method required. all of them need to be implemented.
@@ -90,6 +134,7 @@ class GenericApplication(Application):
         This method allows to define the module parameters: application specific things
         The parameters, for ex. 'script' will become a module member. 
         """
+        from DIRAC.Core.Workflow.Parameter import Parameter ## Imported here: only needed when building the workflow
         m1 = self._createModuleDefinition() ## This line MUST be there.
         ## Below is optional if there are no parameters. The return statement is mandatory.
         m1.addParameter(Parameter("script",      "", "string", "", "", False,
@@ -98,6 +143,12 @@ class GenericApplication(Application):
                                   False, "Arguments to pass to the script"))
         m1.addParameter(Parameter("debug",    False,   "bool", "", "", False,
                                   False, "debug mode"))
+        m1.addParameter(Parameter("parametricValues", "", "string", "", "", False,
+                                  False, "Arguments of the runs of the script, JSON list"))
+        m1.addParameter(Parameter("numberOfProcesses", 0, "int", "", "", False,
+                                  False, "Maximum number of runs at the same time"))
+        m1.addParameter(Parameter("writeResourcesFile", False, "bool", "", "", False,
+                                  False, "Write the resources used to the output sandbox"))
         return m1
 
     def _applicationModuleValues(self, moduleinstance):
@@ -110,6 +161,10 @@ class GenericApplication(Application):
         moduleinstance.setValue("script",    self.Script)
         moduleinstance.setValue('arguments', self.Arguments)
         moduleinstance.setValue('debug',     self.Debug)
+        if self.ParametricValues:
+            moduleinstance.setValue('parametricValues', json.dumps(self.ParametricValues))
+        moduleinstance.setValue('numberOfProcesses', self.NumberOfProcesses)
+        moduleinstance.setValue('writeResourcesFile', self.ReportResources)
 
     ### Add the modules to the step: depending on the type of job: UIser Job or ProductionJob
     def _userjobmodules(self, stepdefinition):
@@ -154,6 +209,13 @@ class GenericApplication(Application):
             self._job._addSoftware(depn, depv)
         return S_OK()
 
+    def _doSomethingWithJob(self):
+        """ Get the resources used by the script back in the output sandbox, if asked for
+        """
+        if self.ReportResources and not RESOURCES_FILES in self._job.addToOutputSandbox:
+            self._job.addToOutputSandbox.append(RESOURCES_FILES)
+        return S_OK()
+
     ##### Consistency check
     def _checkConsistency(self):
         """ Checks that script and dependencies are set.
@@ -170,7 +232,17 @@ class GenericApplication(Application):
         """ 
         Validate the workflow consistency: If to run an application, another must have ran before, make sure it does.
         """
-        return self._checkRequiredApp() # method defined in Application
+        res = self._checkRequiredApp() # method defined in Application
+        if not res['OK']:
+            return res
+        if self.ParametricValues:
+            #The runs cannot share a named pipe
+            if self._streamoutput:
+                return S_ERROR("Cannot stream the output of a script run for several parametric values")
+            for app in self._inputapp:
+                if app._streamoutput:
+                    return S_ERROR("Cannot stream %s to a script run for several parametric values" % app.appname)
+        return S_OK()
 
     def _resolveLinkedStepParameters(self, stepinstance):
         """
@@ -5,12 +5,15 @@ Use L{UserJob} or L{ProductionJob}.
 @author: Stephane Poss
 '''
 
+#The base class is needed to define Job, it cannot be imported later
 from DIRAC.Interfaces.API.Job                          import Job as DiracJob
-from DIRAC.Core.Utilities.PromptUser                   import promptUser
-from DIRAC.Core.Workflow.Step                          import StepDefinition
+from Core.Utilities.InputSandbox                       import flattenInputSandbox
+from Interfaces.API.ArgumentChecks                     import checkArgs
+#PromptUser and StepDefinition are only imported when needed, to keep this module fast to import
 
 from DIRAC import S_ERROR, S_OK, gLogger
-import inspect
+from collections import OrderedDict
+import inspect, sys, json
 
 __RCSID__ = "$Id:  $"
 
@@ -25,6 +28,8 @@ class Job(DiracJob):
         self.log = gLogger.getSubLogger("BaseJob")
         self.applicationlist = []
         self.inputsandbox = []
+        #Files already in the input sandbox, to keep it free of duplicates in constant time per file
+        self._inputsandboxset = set()
         self.outputsandbox = []
         self.check = True
         self.systemConfig = ''
@@ -33,6 +38,8 @@ class Job(DiracJob):
         self.nbevts = 0
         self.energy = 0
         self.oktosubmit = False
+        #Software packages needed, as an ordered set of "app.version": written to the workflow in _addToWorkflow
+        self.softwarePackages = OrderedDict()
         #self.setSystemConfig('x86_64-slc5-gcc43-opt')
 
     def setInputData(self, lfns):
@@ -102,6 +109,7 @@ class Job(DiracJob):
             self.log.notice(app)
             app.listAttributes()
             self.log.notice("\n")
+        from DIRAC.Core.Utilities.PromptUser import promptUser
         res = promptUser('Proceed and submit job(s)?', logger = self.log)
         if not res['OK']:
             return S_ERROR("User did not validate")
@@ -144,9 +152,9 @@ class Job(DiracJob):
         ### Once the consistency has been checked, we can add the application to the list of apps.
         self.applicationlist.append(application)
         ##Get the application's sandbox and add it to the job's
-        for isb in application.inputSB:
-            if not isb in self.inputsandbox:
-                self.inputsandbox.append(isb)
+        res = self._addToInputSandbox(application.inputSB)
+        if not res['OK']:
+            return res
         #if application.NbEvts:
         #    self._addParameter(self.workflow, 'NbOfEvts', 'int', application.NbEvts, "Number of events to process")
         
@@ -156,10 +164,45 @@ class Job(DiracJob):
           
         return S_OK()
     
+    def _addToInputSandbox(self, files):
+        """ Private method
+
+        Add files to the input sandbox, in order and without duplicates. Lists of files are flattened.
+        @param files: list of files or lists of files
+        @return: S_OK() or S_ERROR()
+        """
+        res = flattenInputSandbox(files, self._inputsandboxset)
+        if not res['OK']:
+            return res
+        if res['Value']['ListOfLists']:
+            self.log.warn("Input Sandbox contains list of lists. Please avoid that.")
+        self.inputsandbox.extend(res['Value']['Files'])
+        return S_OK()
+
+    def _setInputSandbox(self, files):
+        """ Private method
+
+        Replace the input sandbox, keeping the set of its files in line with it. Lists of files are flattened.
+        @param files: list of files or lists of files
+        @return: S_OK(True if there were lists of files) or S_ERROR()
+        """
+        seen = set()
+        res = flattenInputSandbox(files, seen)
+        if not res['OK']:
+            return res
+        self.inputsandbox = res['Value']['Files']
+        self._inputsandboxset = seen
+        return S_OK(res['Value']['ListOfLists'])
+
     def _addToWorkflow(self):
         """ This is called just before submission. It creates the actual workflow. 
         The linking of parameters can only be done here
         """
+        from DIRAC.Core.Workflow.Step import StepDefinition
+        #Steps each step depends on, for the steps running in parallel (see UserJob.setParallelSteps)
+        stepnames = {}
+        producers = {}
+        dependencies = {}
         for application in self.applicationlist:
             #Start by defining step number 
             self.stepnumber = len(self.steps) + 1
@@ -210,7 +253,23 @@ class Job(DiracJob):
             #Now prevent overwriting of parameter values.
             application._addedtojob()
             
+            deps = [stepnames[id(app)] for app in application._inputapp if stepnames.has_key(id(app))]
+            for inputfile in application.InputFile.split(";"):
+                if producers.has_key(inputfile) and not producers[inputfile] in deps:
+                    deps.append(producers[inputfile])
+            dependencies[stepname] = deps
+            stepnames[id(application)] = stepname
+            if application.OutputFile:
+                producers[application.OutputFile] = stepname
+            
             self._addParameter(self.workflow, 'TotalSteps', 'String', self.stepnumber, 'Total number of steps')
+        
+        self._addParameter(self.workflow, 'StepDependencies', 'String', json.dumps(dependencies), 
+                           'Steps each step depends on')
+        
+        if self.softwarePackages:
+            self._addParameter( self.workflow, 'SoftwarePackages', 'JDL', ';'.join( self.softwarePackages.keys() ), 
+                                'AL Software Packages to be installed' )
           
         return S_OK()
     
@@ -249,52 +308,41 @@ class Job(DiracJob):
     
     def _addSoftware( self, appName, appVersion ):
         """ Private method
-        """
-        
-        currentApp  = "%s.%s" % ( appName.lower(), appVersion )
-        swPackages  = 'SoftwarePackages'
-        description = 'AL Software Packages to be installed'
-        
-        if not self.workflow.findParameter( swPackages ):
-            self._addParameter( self.workflow, swPackages, 'JDL', currentApp, description )
-        else:
-            apps = self.workflow.findParameter( swPackages ).getValue()
         
-            if not currentApp in apps.split( ';' ):
-                apps += ';' + currentApp
+        Register the software package, the SoftwarePackages parameter is set once in L{_addToWorkflow}
+        """
+        self.softwarePackages[ "%s.%s" % ( appName.lower(), appVersion ) ] = None
+    
+    def getSoftwarePackages( self ):
+        """ Helper function
         
-            self._addParameter( self.workflow, swPackages, 'JDL', apps, description )
+        Return the list of software packages needed by the job, as "app.version"
+        """
+        return self.softwarePackages.keys()
     
     ######## Internal methods. Shouldn't be overloaded.
-    def _checkArgs( self, argNamesAndTypes ):
+    def _checkArgs( self, argNamesAndTypes, args = None ):
         """ Private method to check the validity of the parameters
-        """
-        
-        # inspect.stack()[1][0] returns the frame object ([0]) of the caller
-        # function (stack()[1]).
-        # The frame object is required for getargvalues. Getargvalues returns
-        # a tuple with four items. The fourth item ([3]) contains the local
-        # variables in a dict.
-        
-        args = inspect.getargvalues( inspect.stack()[ 1 ][ 0 ] )[ 3 ]
-        
-        #
         
-        for argName, argType in argNamesAndTypes.iteritems():
+        Called by the L{typed} decorator with the arguments of the decorated method. When called without args, 
+        the arguments are taken from the frame of the calling method. The checks are done by 
+        L{ArgumentChecks.checkArgs}, the errors are reported from here.
+        """
         
-            if not args.has_key(argName):
-                self._reportError(
-                                  'Method does not contain argument \'%s\'' % argName,
-                                  __name__,
-                                  **self._getArgsDict( 1 )
-                                  )
+        if args is None:
+            # sys._getframe(1) returns the frame object of the caller function,
+            # without resolving the source of the whole stack like inspect.stack().
+            # The frame object is required for getargvalues. Getargvalues returns
+            # a tuple with four items. The fourth item ([3]) contains the local
+            # variables in a dict.
+            
+            args = inspect.getargvalues( sys._getframe( 1 ) )[ 3 ]
+            reportArgs = self._getArgsDict( 1 )
+        else:
+            reportArgs = args
         
-            if not isinstance( args[argName], argType):
-                self._reportError(
-                                  'Argument \'%s\' is not of type %s' % ( argName, argType ),
-                                  __name__,
-                                  **self._getArgsDict( 1 )
-                                  )
+        for message in checkArgs( argNamesAndTypes, args ):
+            self._reportError( message, __name__, **reportArgs )
     
     def _getArgsDict( self, level = 0 ):
         """ Private method
@@ -307,7 +355,7 @@ class Job(DiracJob):
         
         #
         
-        args = inspect.getargvalues( inspect.stack()[ level ][ 0 ] )
+        args = inspect.getargvalues( sys._getframe( level ) )
         adict = {}
         
         for arg in args[0]:
@@ -7,9 +7,8 @@ User Job class. Used to define (guess what?) user jobs!
 '''
 
 from Interfaces.API.Job                             import Job
-from Interfaces.API.Dirac                           import Dirac
-from DIRAC.Core.Security.ProxyInfo                           import getProxyInfo
-from DIRAC.ConfigurationSystem.Client.Helpers.Registry       import getVOForGroup
+from Core.Utilities.ProxyInfoCache                           import getProxyInfo
+#The Dirac API and the Registry are only imported when needed, to keep this module fast to import
 
 from DIRAC import S_OK
 
@@ -17,6 +16,9 @@ import types
 
 __RCSID__ = "$Id: $"
 
+#: Job parameters that can differ between the jobs of a L{UserJob.submitBulk} call
+BULK_PARAMETERS = ['Name', 'Arguments', 'InputData', 'OutputData']
+
 class UserJob(Job):
     """ User job class. To be used by users, not for production.
     """
@@ -33,7 +35,95 @@ class UserJob(Job):
         
         If you have a Dirac instance, you can pass it, otherwise it will create one on the fly.
         """
-        #Check the credentials. If no proxy or not user proxy, return an error
+        res = self._checkProxy()
+        if not res['OK']:
+            return res
+        
+        res = self._addToWorkflow()
+        if not res['OK']:
+            return res
+        self.oktosubmit = True
+        if not diracinstance:
+            from Interfaces.API.Dirac import Dirac
+            self.diracinstance = Dirac()
+        else:
+            self.diracinstance = diracinstance
+        return self.diracinstance.submit(self, mode)
+    
+    def submitBulk(self, paramSets, diracinstance = None, mode = "wms"):
+        """ Submit one job per entry of paramSets, building and checking the workflow only once.
+        
+        Every entry is a dictionary describing what changes from one job to the next. All entries
+        must use the same keys, chosen among L{BULK_PARAMETERS}:
+        
+        >>> job.submitBulk([{"Arguments":"1", "OutputData":["out_1.ext"]},
+        ...                 {"Arguments":"2", "OutputData":["out_2.ext"]}], dirac)
+        
+        The Arguments are appended to the command line of the applications (as ParametricParameters).
+        
+        @param paramSets: per job parameters
+        @type paramSets: list of dict
+        @return: S_OK({'Successful':{index:jobID}, 'Failed':{index:message}})
+        """
+        kwargs = {'paramSets' : paramSets}
+        if not type(paramSets) == types.ListType or not len(paramSets):
+            return self._reportError('Expected a non empty list of dictionaries', **kwargs)
+        keys = None
+        for params in paramSets:
+            if not type(params) == types.DictType:
+                return self._reportError('Expected a non empty list of dictionaries', **kwargs)
+            if keys is None:
+                keys = set(params.keys())
+            elif set(params.keys()) != keys:
+                return self._reportError('All parameter sets must define the same keys: %s' % ", ".join(keys), 
+                                         **kwargs)
+        unknown = keys.difference(BULK_PARAMETERS)
+        if unknown:
+            return self._reportError('Cannot vary %s, only %s are supported' % (", ".join(unknown), 
+                                                                               ", ".join(BULK_PARAMETERS)), 
+                                     **kwargs)
+        
+        res = self._checkProxy()
+        if not res['OK']:
+            return res
+        
+        res = self._addToWorkflow()
+        if not res['OK']:
+            return res
+        self.oktosubmit = True
+        if not diracinstance:
+            from Interfaces.API.Dirac import Dirac
+            self.diracinstance = Dirac()
+        else:
+            self.diracinstance = diracinstance
+        return self.diracinstance.submitMany(self, paramSets, mode)
+    
+    def _setVariant(self, params):
+        """ Private method
+        
+        Called from L{Dirac.submitMany} to stamp the per job parameters on the already built workflow
+        """
+        if params.has_key('Name'):
+            self.setName(params['Name'])
+        if params.has_key('Arguments'):
+            self._addParameter(self.workflow, 'ParametricParameters', 'JDL', params['Arguments'], 
+                               'Arguments specific to this job')
+        if params.has_key('InputData'):
+            res = self.setInputData(params['InputData'])
+            if not res['OK']:
+                return res
+        if params.has_key('OutputData'):
+            #Only the UserOutputData changes: the UserOutputSE and UserOutputPath of the job are kept
+            res = self.setOutputData(params['OutputData'], OutputPath = '', OutputSE = [])
+            if not res['OK']:
+                return res
+        return S_OK()
+    
+    def _checkProxy(self):
+        """ Private method
+        
+        Check the credentials. If no proxy or not user proxy, return an error
+        """
         if not self.proxyinfo['OK']:
             self.log.error("Not allowed to submit a job, you need one of %s proxies." % self.usergroup)
             return self._reportError("Not allowed to submit a job, you need one of %s proxies." % self.usergroup,
@@ -47,16 +137,7 @@ class UserJob(Job):
         else:
             self.log.error("Could not determine group, you do not have the right proxy.")       
             return self._reportError("Could not determine group, you do not have the right proxy.")
-        
-        res = self._addToWorkflow()
-        if not res['OK']:
-            return res
-        self.oktosubmit = True
-        if not diracinstance:
-            self.diracinstance = Dirac()
-        else:
-            self.diracinstance = diracinstance
-        return self.diracinstance.submit(self, mode)
+        return S_OK()
         
     #############################################################################
     def setInputData( self, lfns ):
@@ -97,7 +178,9 @@ class UserJob(Job):
             flist = [flist]
         if not type(flist) == type([]) :
             return self._reportError("File passed must be either single file or list of files.") 
-        self.inputsandbox.extend(flist)
+        res = self._addToInputSandbox(flist)
+        if not res['OK']:
+            return self._reportError(res['Message'])
         return S_OK()
     
     #############################################################################
@@ -151,6 +234,7 @@ class UserJob(Job):
             while OutputPath.count("//"):
                 OutputPath.replace('//','/')  
             
+            from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getVOForGroup
             vo = getVOForGroup(self.proxyinfo['Value']['group'])
             vostring = '/%s/user' % vo
             if OutputPath.count(vostring):
@@ -188,3 +272,26 @@ class UserJob(Job):
             return self._reportError( 'Expected file string or list of files for output sandbox contents', **kwargs )
         
         return S_OK()
+    
+    #############################################################################
+    def setParallelSteps(self, maxSteps):
+        """Helper function.
+        
+           Allow the steps that do not depend on each other to run at the same time, at most maxSteps of them
+           (and not more than the processors of the worker node). A step depends on the steps whose output it
+           uses, see L{Application.getInputFromApp}, or whose OutputFile is one of its InputFile.
+        
+           Example usage:
+        
+           >>> job = UserJob()
+           >>> job.setParallelSteps(4)
+        
+           @param maxSteps: maximum number of steps running at the same time
+           @type maxSteps: int
+        
+        """
+        if not type(maxSteps) in (types.IntType, types.LongType) or maxSteps < 1:
+            kwargs = {'maxSteps' : maxSteps}
+            return self._reportError('Expected a positive integer for the number of parallel steps', **kwargs)
+        self._addParameter(self.workflow, 'ParallelSteps', 'int', maxSteps, 'Maximum number of steps running at once')
+        return S_OK()
@@ -8,11 +8,25 @@ Run any application provided by the user. Is used when a specific environment is
 '''
 __RCSID__ = "$Id: $"
 
-import os, re, types, shutil
-from DIRAC.Core.Utilities.Subprocess                      import shellCall
+import os, re, sys, time, types, shutil, shlex, json, pipes, fnmatch, threading
 from Workflow.Modules.ModuleBase                          import ModuleBase
+from Workflow.Utilities.ProcessRunner                     import runCommand, getAllocatedProcessors
+from Workflow.Utilities.ResourceSampler                   import ResourceSampler
+from Workflow.Utilities.StreamLink                        import StreamingStep, createPipe
+from Workflow.Utilities.LogSink                           import LogSink
+from Workflow.Utilities.DirectorySnapshot                 import takeSnapshot, diffSnapshots
+from Core.Utilities.ThreadedMap                           import threadedMap
 from DIRAC                                                import S_OK, S_ERROR, gLogger
 
+#: Characters meaning something to the shell: arguments containing them are given to bash, as before
+SHELL_CHARACTERS = re.compile(r'[$`*?\[\]|&;<>(){}~\n]')
+
+def addSuffix(fileName, suffix):
+    """ Insert the suffix before the extension: out.slcio becomes out_1.slcio
+    """
+    root, ext = os.path.splitext(fileName)
+    return root + suffix + ext
+
 class ApplicationScript(ModuleBase):
     """ Default application environment. Called GenericApplication in the Interface.
     """
@@ -22,18 +36,24 @@ class ApplicationScript(ModuleBase):
         self.log = gLogger.getSubLogger( "ScriptAnalysis" )
         self.script = None # Overwritten by the Workflow class when initializing the module
         self.arguments = '' # Overwritten by the Workflow class when initializing the module
+        self.parametricValues = '' # Overwritten by the Workflow class when initializing the module
+        self.numberOfProcesses = 0 # Overwritten by the Workflow class when initializing the module
+        self.writeResourcesFile = False # Overwritten by the Workflow class when initializing the module
+        #The parametric runs share the stager and the standard output
+        self._stagerLock = threading.Lock()
+        self._outputLock = threading.Lock()
         self.applicationName = 'Application script'
         self.applicationVersion = ''
       
     def applicationSpecificInputs(self):
         self.log.info("The arguments are %s"% self.arguments)
         if 'ParametricParameters' in self.workflow_commons:
-            parametric = ' '
+            parametric = ''
             if type(self.workflow_commons['ParametricParameters']) == types.ListType:
                 parametric = " ".join(self.workflow_commons['ParametricParameters'])
             else:
                 parametric = self.workflow_commons['ParametricParameters']
-            self.arguments += parametric
+            self.arguments += ' ' + parametric
         
         return S_OK()
     
@@ -46,6 +66,262 @@ class ApplicationScript(ModuleBase):
                 shutil.copy2(os.path.join(self.basedirectory, self.script), "./"+self.script)
         return S_OK()
     
+    def getApplicationEnvironment(self):
+        """ Environment of the application: the current one, with ./lib first in the LD_LIBRARY_PATH if it exists
+        @return: dict
+        """
+        env = dict(os.environ)
+        if os.path.exists("./lib"):
+            if env.get('LD_LIBRARY_PATH'):
+                env['LD_LIBRARY_PATH'] = './lib:%s' % env['LD_LIBRARY_PATH']
+            else:
+                env['LD_LIBRARY_PATH'] = './lib'
+        return env
+    
+    def dumpEnvironment(self, env, fileName = 'localEnv.log'):
+        """ Append the sorted environment to fileName, like env | sort would
+        @return: S_OK() or S_ERROR()
+        """
+        try:
+            envFile = open(fileName, 'a')
+            try:
+                for key in sorted(env.keys()):
+                    envFile.write('%s=%s\n' % (key, env[key]))
+            finally:
+                envFile.close()
+        except EnvironmentError, why:
+            self.log.error("Could not write the environment:", str(why))
+            return S_ERROR('Could not write %s' % fileName)
+        return S_OK()
+    
+    def reportResources(self, summary):
+        """ Set the resources used by the application as the Resources_<step> job parameter, and write them to
+        <step>_resources.json, that ends up in the output sandbox, if writeResourcesFile is set
+        @param summary: L{ResourceSampler.getSummary} result
+        """
+        stepName = self.step_commons.get("STEP_DEFINITION_NAME", os.path.basename(self.script))
+        record = json.dumps(summary, separators = (',', ':'), sort_keys = True)
+        self.log.info("Resources used by %s:" % os.path.basename(self.script), record)
+        if self.writeResourcesFile:
+            try:
+                resourcesFile = open('%s_resources.json' % stepName, 'w')
+                try:
+                    resourcesFile.write(record)
+                finally:
+                    resourcesFile.close()
+            except EnvironmentError, why:
+                self.log.warn("Could not write the resources file:", str(why))
+        if self.jobReport:
+            result = self.jobReport.setJobParameter('Resources_%s' % stepName, record, sendFlag = False)
+            if not result['OK']:
+                self.log.warn("Could not set the resources used:", result['Message'])
+    
+    def startStreaming(self, argv, env, banner):
+        """ Start the application in the background, writing its OutputFile to a named pipe in the job directory 
+        that the next step reads
+        @param banner: first lines of the log
+        @return: S_OK() or S_ERROR()
+        """
+        outputFile = os.path.basename(self.OutputFile)
+        pipe = os.path.join(self.basedirectory, outputFile)
+        res = createPipe(pipe)
+        if not res['OK']:
+            self.log.error(res['Message'])
+            return res
+        if os.path.lexists(outputFile):
+            os.remove(outputFile)
+        os.symlink(pipe, outputFile)
+        stepName = self.step_commons.get("STEP_DEFINITION_NAME", os.path.basename(self.script))
+        self.streaming = StreamingStep(stepName, pipe, os.path.join(os.getcwd(), self.applicationLog), 
+                                       self.basedirectory)
+        for line in banner:
+            self.streaming.writeLog(0, line)
+        self.streaming.start(argv, env, os.getcwd())
+        self.workflow_commons.setdefault('StreamingSteps', {})[outputFile] = self.streaming
+        self.log.info("%s is streaming %s to the next step" % (os.path.basename(self.script), outputFile))
+        return S_OK('%s (%s %s) streaming %s' % (os.path.basename(self.script), self.applicationName, 
+                                                 self.applicationVersion, outputFile))
+    
+    def getParametricValues(self):
+        """ Arguments of the runs of the script, see L{GenericApplication.setParametricValues}
+        @return: S_OK(list), empty if the script runs once, or S_ERROR()
+        """
+        if not self.parametricValues:
+            return S_OK([])
+        if type(self.parametricValues) == types.ListType:
+            return S_OK(self.parametricValues)
+        try:
+            return S_OK(json.loads(self.parametricValues))
+        except ValueError, why:
+            self.log.error("Could not read the parametric values:", str(why))
+            return S_ERROR('Invalid parametric values')
+    
+    def runParametric(self, arguments, env, banner, values):
+        """ Run the script once per value, appended to the arguments. At most numberOfProcesses runs at the same time, and 
+        not more than the processors allocated to the job.
+        
+        Run i works in the directory run_i, with links to the files of the step. Its log is the application log 
+        with the suffix _i, and the files it creates are moved to the step directory with the same suffix. They are
+        added to the UserOutputData if their name without suffix is, see L{addParametricOutputData}.
+        @param banner: first lines of the application log, that lists the status of every run
+        @return: S_OK() if all the runs succeeded, S_ERROR() otherwise
+        """
+        processes = getAllocatedProcessors()
+        if self.numberOfProcesses:
+            processes = min(processes, int(self.numberOfProcesses))
+        processes = min(processes, self.ops.getValue('/Modules/ApplicationScript/MaxProcesses', processes))
+        for line in banner:
+            self.redirectLogOutput(0, line)
+        self.redirectLogOutput(0, 'Running %s values, %s at a time' % (len(values), processes))
+        
+        stepdir = os.getcwd()
+        names = [name for name in os.listdir(stepdir) if name != self.applicationLog]
+        start = time.time()
+        childrenCPU = sum(os.times()[2:4])
+        runs = threadedMap(lambda index: self.runValue(index, self.getCommand('%s %s' % (arguments, values[index])), 
+                                                       env, stepdir, names),
+                           range(len(values)), processes)
+        summary = {'Wall' : round(time.time() - start, 3), 'CPU' : round(sum(os.times()[2:4]) - childrenCPU, 3),
+                   'Runs' : {}}
+        
+        failed = []
+        for index, res in enumerate(runs):
+            if not res['OK']:
+                self.redirectLogOutput(1, 'Run %s (%s) failed: %s' % (index, values[index], res['Message']))
+                failed.append(values[index])
+                continue
+            run = res['Value']
+            self.renamedOutputs.update(run['Files'])
+            summary['Runs'][str(index)] = run['Resources']
+            self.redirectLogOutput(0, 'Run %s (%s) exited with status %s' % (index, values[index], run['Status']))
+            if run['Status'] != 0:
+                self.log.error("StdError of run %s:\n" % index, run['StdError'])
+                failed.append(values[index])
+        self.reportResources(summary)
+        self.addParametricOutputData()
+        
+        script = os.path.basename(self.script)
+        if failed:
+            self.log.error("%s failed for the values:" % script, ", ".join(failed))
+            return S_ERROR('%s failed for %s of %s values' % (script, len(failed), len(values)))
+        self.setApplicationStatus('%s (%s %s) Successful for %s values' % (script, self.applicationName, 
+                                                                         self.applicationVersion, len(values)))
+        return S_OK('%s (%s %s) Successful for %s values' % (script, self.applicationName, self.applicationVersion, 
+                                                            len(values)))
+    
+    def runValue(self, index, argv, env, stepdir, names):
+        """ One run of L{runParametric}, in the directory run_<index>
+        @param names: files of the step, linked in the run directory
+        @return: S_OK({'Status': exit status, 'Resources': L{ResourceSampler.getSummary}, 'StdError': end of the 
+        standard error, 'Files': {name with suffix: name}}) or S_ERROR()
+        """
+        suffix = '_%s' % index
+        rundir = os.path.join(stepdir, 'run%s' % suffix)
+        try:
+            os.mkdir(rundir)
+            for name in names:
+                os.symlink(os.path.join(stepdir, name), os.path.join(rundir, name))
+        except EnvironmentError, why:
+            return S_ERROR("Could not prepare %s: %s" % (rundir, str(why)))
+        before = takeSnapshot(rundir)
+        
+        logSink = LogSink(self.logSink.bufferSize, self.logSink.flushInterval, self.logSink.flushSize, 
+                          self.logSink.stdErrorSize)
+        def writeLog(fd, message):
+            self._outputLock.acquire()
+            try:
+                sys.stdout.write('[%s] %s\n' % (index, message))
+            finally:
+                self._outputLock.release()
+            logSink.write(message + '\n')
+            if fd == 1:
+                logSink.addStdError(message)
+        logSink.open(os.path.join(stepdir, addSuffix(self.applicationLog, suffix)))
+        writeLog(0, 'Log file from execution of: %s' % ' '.join(argv))
+        sampler = ResourceSampler(interval = self.ops.getValue('/Modules/ResourceSampler/Interval', 5.),
+                                  useChildrenTimes = False)
+        try:
+            res = runCommand(argv, env = env, callbackFunction = writeLog, cwd = rundir, onStart = sampler.start)
+        finally:
+            sampler.stop()
+            logSink.close()
+        if not res['OK']:
+            return res
+        
+        changes = diffSnapshots(before, takeSnapshot(rundir))
+        files = {}
+        try:
+            for name in changes['New'] + changes['Modified']:
+                if os.path.islink(os.path.join(rundir, name)):
+                    continue
+                self._stagerLock.acquire()
+                try:
+                    self.stager.move(os.path.join(rundir, name), os.path.join(stepdir, addSuffix(name, suffix)))
+                finally:
+                    self._stagerLock.release()
+                files[addSuffix(name, suffix)] = name
+            shutil.rmtree(rundir)
+        except EnvironmentError, why:
+            return S_ERROR("Could not get the files of run %s: %s" % (index, str(why)))
+        return S_OK({'Status' : res['Value'], 'Resources' : sampler.getSummary(), 'StdError' : logSink.getStdError(),
+                     'Files' : files})
+    
+    def addParametricOutputData(self):
+        """ Add the files of the parametric runs to the UserOutputData when it names them without their suffix, 
+        so that the UserJobFinalization uploads them
+        """
+        outputData = self.workflow_commons.get('UserOutputData')
+        if not outputData or not self.renamedOutputs:
+            return
+        patterns = outputData
+        if not type(patterns) == types.ListType:
+            patterns = [pattern.strip() for pattern in patterns.split(';')]
+        added = []
+        for name, declared in sorted(self.renamedOutputs.items()):
+            if [pattern for pattern in patterns if fnmatch.fnmatch(name, pattern)]:
+                continue
+            if [pattern for pattern in patterns if fnmatch.fnmatch(declared, pattern)]:
+                added.append(name)
+        if not added:
+            return
+        self.log.info("Output data of the parametric runs:", ", ".join(added))
+        if type(outputData) == types.ListType:
+            self.workflow_commons['UserOutputData'] = outputData + added
+        else:
+            self.workflow_commons['UserOutputData'] = ';'.join(patterns + added)
+    
+    def getCommand(self, arguments):
+        """ Arguments list running the script with the given arguments
+        
+        Python scripts are run with python, and scripts without #! line with bash, as the shell did. Arguments 
+        using the shell (variables, globs, redirections...) are passed through bash -c as before, the other ones
+        are split like the shell would and passed directly.
+        @param arguments: arguments of the script, as a string
+        @return: list of arguments
+        """
+        script = os.path.basename(self.script)
+        if re.search('.py$', script):
+            argv = ['python', script]
+        elif self._hasShebang(script):
+            argv = ['./' + script]
+        else:
+            argv = ['/bin/bash', script]
+        if SHELL_CHARACTERS.search(arguments):
+            return ['/bin/bash', '-c', ' '.join([pipes.quote(arg) for arg in argv] + [arguments])]
+        return argv + shlex.split(arguments)
+    
+    def _hasShebang(self, script):
+        """ True if the script starts with #!, or cannot be read: running it then reports the problem
+        """
+        try:
+            scriptFile = open(script, 'rb')
+            try:
+                return scriptFile.read(2) == '#!'
+            finally:
+                scriptFile.close()
+        except EnvironmentError:
+            return True
+    
     def runIt(self):
         """ Run the application in a controlled environment
         """
@@ -63,45 +339,49 @@ class ApplicationScript(ModuleBase):
             return S_OK('ApplicationScript should not proceed as previous step did not end properly')
         
         
-        Cmd = []
-        if re.search('.py$', self.script):
-            Cmd.append('python')
-            Cmd.append(os.path.basename(self.script))
-        else:
-            Cmd.append("./" + os.path.basename(self.script))
-        Cmd.append(self.arguments)
-        Cmd.append(self.extraCLIarguments)
+        arguments = ' '.join([args for args in (self.arguments, self.extraCLIarguments) if args])
+        argv = self.getCommand(arguments)
         
-        command = ' '.join(Cmd)
+        command = ' '.join(argv)
         self.log.info( 'Command = %s' % (command))  #Really print here as this is useful to see
         
-        com = []
-        cmdSep = 'echo "%s"' % ('=' * 50)
-        com.append(cmdSep)
-        com.append('echo "Log file from execution of: %s"' % (command))
-        com.append(cmdSep)
-        com.append('env | sort >> localEnv.log')
-        com.append(cmdSep)
-        if os.path.exists("./lib"):
-            com.append('declare -x LD_LIBRARY_PATH=./lib:$LD_LIBRARY_PATH')
-        com.append(command)
-        com.append('declare -x appstatus=$?')
-        com.append('exit $appstatus')
-        finalCommand = ';'.join(com)
+        env = self.getApplicationEnvironment()
+        res = self.dumpEnvironment(env)
+        if not res['OK']:
+            return res
+        
+        cmdSep = '=' * 50
+        banner = [cmdSep, 'Log file from execution of: %s' % (command), cmdSep, cmdSep]
+        res = self.getParametricValues()
+        if not res['OK']:
+            return res
+        if res['Value']:
+            if self.streamOutput or self._streamedInputs:
+                return S_ERROR('Cannot stream to or from a script run for several parametric values')
+            return self.runParametric(arguments, env, banner, res['Value'])
+        if self.streamOutput:
+            return self.startStreaming(argv, env, banner)
+        for line in banner:
+            self.redirectLogOutput(0, line)
         
         self.stdError = ''
         
         ##Call the command !!
-        result = shellCall(0, finalCommand, callbackFunction = self.redirectLogOutput , bufferLimit = 20971520)
+        sampler = ResourceSampler(interval = self.ops.getValue('/Modules/ResourceSampler/Interval', 5.))
+        def started(pid):
+            sampler.start(pid)
+            self.registerStreamConsumer(pid)
+        try:
+            result = runCommand(argv, env = env, callbackFunction = self.redirectLogOutput, onStart = started,
+                                newProcessGroup = len(self._streamedInputs) > 0)
+        finally:
+            sampler.stop()
+        self.reportResources(sampler.getSummary())
         if not result['OK']:
             self.log.error("Application failed :", result["Message"])
             return S_ERROR('Problem Executing Application')
         
-        resultTuple = result['Value']
-        
-        status = resultTuple[0]
-        # stdOutput = resultTuple[1]
-        # stdError = resultTuple[2]
+        status = result['Value']
         self.log.info( "Status after %s execution is %s" %(os.path.basename(self.script), str(status)) )
         failed = False
         if status != 0:
@@ -6,15 +6,20 @@ Created on Feb 6, 2014
 @author: stephanep
 '''
 from DIRAC                                                import gLogger, S_OK, S_ERROR
-from DIRAC.Core.Security.ProxyInfo                        import getProxyInfoAsString
+from Core.Utilities.ProxyInfoCache                        import getProxyInfoAsString
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations  import Operations
 from DIRAC.WorkloadManagementSystem.Client.JobReport      import JobReport
 from DIRAC.RequestManagementSystem.Client.Request         import Request
 from DIRAC.RequestManagementSystem.private.RequestValidator   import gRequestValidator
+from Workflow.Utilities.LogSink                           import LogSink
+from Workflow.Utilities.FileMetadata                      import getFilesChecksums
+from Workflow.Utilities.StepProfile                       import StepProfile
+from Workflow.Utilities.Staging                           import Stager
+from Workflow.Utilities.DirectorySnapshot                 import takeSnapshot, diffSnapshots, SIZE, MTIME, ISDIR
+from Workflow.Utilities.StepScheduler                     import StepScheduler, snapshotCommons, getCommonsChanges
 #from ExtDIRAC.Core.Utilities.FileUtilities                 import fullCopy
 
-import os, urllib, types, shutil, glob, sys
-from DIRAC.Core.Utilities.Adler import fileAdler
+import os, urllib, types, fnmatch, stat, json, multiprocessing
 from DIRAC.Core.Utilities.File import makeGuid
 
 class ModuleBase(object):
@@ -48,6 +53,10 @@ class ModuleBase(object):
         self.ignoremissingInput = False
         self.OutputFile = ''
         self.jobType = ''
+        self.logSink = LogSink(bufferSize = self.ops.getValue('/Modules/LogSink/BufferSize', 1048576),
+                               flushInterval = self.ops.getValue('/Modules/LogSink/FlushInterval', 5.),
+                               flushSize = self.ops.getValue('/Modules/LogSink/FlushSize', 1048576),
+                               stdErrorSize = self.ops.getValue('/Modules/LogSink/StdErrorSize', 65536))
         self.stdError = ''
         self.debug = False
         self.extraCLIarguments = ""
@@ -71,6 +80,13 @@ class ModuleBase(object):
         self.request = None
         self.jobReport = None
         self.basedirectory = os.getcwd()
+        self.profile = None
+        #Streaming of the OutputFile to the next step, see StreamLink
+        self.streamOutput = False
+        self.streaming = None
+        self._streamedInputs = []
+        #Files created under another name than the one declared by the user: {actual name: declared name}
+        self.renamedOutputs = {}
 
 
     #############################################################################
@@ -150,17 +166,28 @@ class ModuleBase(object):
             candidateFiles[pfn]['GUID'] = guid
         
         #Get all additional metadata about the file necessary for requests
+        #Files are read once, several at a time
+        digests = self.ops.getValue('/Modules/FileMetadata/Digests', [])
+        res = getFilesChecksums(candidateFiles.keys(), digests,
+                                maxThreads = self.ops.getValue('/Modules/FileMetadata/Threads', 4))
+        checksums = res['Value']['Successful']
+        for fileName, message in res['Value']['Failed'].items():
+            self.log.error('Failed to get the metadata of %s:' % fileName, message)
+            return S_ERROR('Failed to get the metadata of %s' % fileName)
+        
         final = {}
         for fileName, metadata in candidateFiles.items():
             fileDict = {}
             fileDict['LFN'] = metadata['lfn']
-            fileDict['Size'] = os.path.getsize(fileName)
-            fileDict['Addler'] = fileAdler(fileName)
+            fileDict['Size'] = checksums[fileName]['Size']
+            fileDict['Addler'] = checksums[fileName]['Addler']
             fileDict['GUID'] = metadata['GUID']
             fileDict['Status'] = "Waiting"   
           
             final[fileName] = metadata
             final[fileName]['filedict'] = fileDict
+            if digests:
+                final[fileName]['digests'] = checksums[fileName]['Digests']
             final[fileName]['localpath'] = '%s/%s' % (os.getcwd(), fileName)  
         
         gLogger.verbose("Full file dict", str(final))
@@ -269,6 +296,7 @@ class ModuleBase(object):
             self.InputFile = inputf
         
         self.ignoremissingInput = self.step_commons.get('ForgetInput', False)
+        self.streamOutput = self.step_commons.get('StreamOutput', False)
                 
         if 'InputData' in self.workflow_commons:
             inputdata = self.workflow_commons['InputData']
@@ -303,14 +331,38 @@ class ModuleBase(object):
     
     def execute(self):
         """ The execute method. This is called by the workflow wrapper when the module is needed
-        Here we do preliminary things like resolving the application parameters, and getting a dedicated directory
+        
+        When the job allows parallel steps, the steps this one depends on are waited for first, and the step 
+        runs in the background if it can, see L{StepScheduler}. Otherwise it runs here in L{executeStep}.
+        """
+        scheduler = self.getStepScheduler()
+        if scheduler:
+            stepName = self.step_commons["STEP_DEFINITION_NAME"]
+            res = scheduler.wait(self.getStepDependencies(stepName), self.workflow_commons)
+            if not res['OK']:
+                self.log.error("A step this one depends on failed:", res['Message'])
+                return res
+            if self.canRunInBackground():
+                self.log.info("Running %s in the background" % stepName)
+                return scheduler.start(stepName, self.executeInBackground)
+        return self.executeStep()
+    
+    def executeStep(self):
+        """ Here we do preliminary things like resolving the application parameters, and getting a dedicated 
+        directory, then run the application
+        
+        The time spent in every phase is recorded in the L{profile}, and reported as a job parameter at the end.
         """
+        self.profile = StepProfile(self.step_commons["STEP_DEFINITION_NAME"])
+        self.stager = Stager(libMode = self.ops.getValue('/Modules/Staging/LibMode', 'hardlink'),
+                             reflink = self.ops.getValue('/Modules/Staging/Reflink', True))
         workdir = os.path.join(self.basedirectory, self.step_commons["STEP_DEFINITION_NAME"])
-        if not os.path.exists(workdir):
-            try:
-                os.makedirs( workdir )
-            except OSError, e:
-                self.log.error("Failed to create the work directory :", str(e))
+        with self.profile.phase("workdir"):
+            if not os.path.exists(workdir):
+                try:
+                    os.makedirs( workdir )
+                except OSError, e:
+                    self.log.error("Failed to create the work directory :", str(e))
         
         #now go there
         os.chdir( workdir )
@@ -321,34 +373,40 @@ class ModuleBase(object):
             self.log.error("Failed to resolve input variables:", result['Message'])
             return result
         
-        if self.InputFile:
-            ##Try to copy the input file to the work fdfir
-            for inf in self.InputFile:
-                bpath = os.path.join(self.basedirectory, inf)
+        with self.profile.phase("inputs"):
+            if self.InputFile:
+                ##Try to copy the input file to the work fdfir
+                for inf in self.InputFile:
+                    bpath = os.path.join(self.basedirectory, inf)
+                    if os.path.exists(bpath):
+                        try:
+                            if stat.S_ISFIFO(os.stat(bpath).st_mode):
+                                #Streamed by the previous step: the pipe stays where the producer writes it
+                                os.symlink(bpath, "./"+inf)
+                                self._streamedInputs.append(inf)
+                                continue
+                            self.profile.addBytes(self.stager.move(bpath, "./"+inf))
+                        except EnvironmentError, why:
+                            self.log.error("Failed to get the file:", str(why))
+            
+                  
+            if self.SteeringFile:
+                bpath = os.path.join(self.basedirectory, os.path.basename(self.SteeringFile))
                 if os.path.exists(bpath):
                     try:
-                        shutil.move(bpath, "./"+inf)
+                        self.profile.addBytes(self.stager.move(bpath, "./"+os.path.basename(self.SteeringFile)))
                     except EnvironmentError, why:
                         self.log.error("Failed to get the file:", str(why))
+                        
+                if os.path.exists(os.path.basename(self.SteeringFile)):
+                    self.log.verbose("Found local copy of %s" % self.SteeringFile)
         
-              
-        if self.SteeringFile:
-            bpath = os.path.join(self.basedirectory, os.path.basename(self.SteeringFile))
-            if os.path.exists(bpath):
+        with self.profile.phase("lib"):
+            if os.path.isdir(os.path.join(self.basedirectory, 'lib')):
                 try:
-                    shutil.move(bpath, "./"+os.path.basename(self.SteeringFile))
+                    self.profile.addBytes(self.stager.stageTree(os.path.join(self.basedirectory, 'lib'), './lib'))
                 except EnvironmentError, why:
-                    self.log.error("Failed to get the file:", str(why))
-                    
-            if os.path.exists(os.path.basename(self.SteeringFile)):
-                self.log.verbose("Found local copy of %s" % self.SteeringFile)
-        
-        
-        if os.path.isdir(os.path.join(self.basedirectory, 'lib')):
-            try:
-                shutil.copytree(os.path.join(self.basedirectory, 'lib'), './lib')
-            except EnvironmentError, why:
-                self.log.error("Failed to get the lib directory:", str(why))
+                    self.log.error("Failed to get the lib directory:", str(why))
         
         #if "Required" in self.step_commons:
         #    reqs = self.step_commons["Required"].rstrip(";").split(";")
@@ -365,64 +423,212 @@ class ModuleBase(object):
         #        self.log.verbose("Copied to local directory", reqitem)
             
         
+        with self.profile.phase("inputs"):
+            try:
+                self.applicationSpecificMoveBefore()    
+            except EnvironmentError, e:
+                self.log.error("Failed to copy the required files", str(e))
+                return S_ERROR("Failed to copy the required files%s" % str(e))
         
-        try:
-            self.applicationSpecificMoveBefore()    
-        except EnvironmentError, e:
-            self.log.error("Failed to copy the required files", str(e))
-            return S_ERROR("Failed to copy the required files%s" % str(e))
-        
-        before_app_dir = os.listdir(os.getcwd())
+        before_app_dir = takeSnapshot(os.getcwd())
         
-        appres = self.runIt()
+        with self.profile.phase("runIt"):
+            try:
+                appres = self.runIt()
+            finally:
+                self.logSink.close()
+            appres = self.waitForStreams(appres)
         if not appres["OK"]:
             self.log.error("Somehow the application did not exit properly")
         
-        ##Try to move things back to the base directory
-        if self.OutputFile:
-            for ofile in glob.glob("*"+self.OutputFile+"*"):
+        with self.profile.phase("outputs"):
+            after_app_dir = takeSnapshot(os.getcwd())
+            changes = diffSnapshots(before_app_dir, after_app_dir)
+            self.addToManifest(after_app_dir, changes)
+            ##Try to move things back to the base directory
+            #When streaming, the application is still running: its output and log are handled by the StreamingStep
+            if self.OutputFile and not self.streaming:
+                #Same files as glob("*"+self.OutputFile+"*"), that does not match the hidden files
+                for ofile in fnmatch.filter(sorted(after_app_dir), "*" + self.OutputFile + "*"):
+                    if ofile.startswith('.'):
+                        continue
+                    try:
+                        self.profile.addBytes(self.stager.move(ofile, os.path.join(self.basedirectory, ofile)))
+                    except EnvironmentError, why:
+                        self.log.error('Failed to move the file back to the main directory:', str(why))
+                        appres = S_ERROR("Failed moving files")
+                  
+            if os.path.exists(self.applicationLog) and not self.streaming:
                 try:
-                    shutil.move(ofile, os.path.join(self.basedirectory, ofile))
+                    self.profile.addBytes(self.stager.move("./"+self.applicationLog, 
+                                                           os.path.join(self.basedirectory, self.applicationLog)))
                 except EnvironmentError, why:
-                    self.log.error('Failed to move the file back to the main directory:', str(why))
-                    appres = S_ERROR("Failed moving files")
+                    self.log.error("Failed to move the log to the basedir", str(why))
               
-        if os.path.exists(self.applicationLog):
             try:
-                shutil.move("./"+self.applicationLog, os.path.join(self.basedirectory, self.applicationLog))
-            except EnvironmentError, why:
-                self.log.error("Failed to move the log to the basedir", str(why))
-          
-        try:
-            self.applicationSpecificMoveAfter()
-        except EnvironmentError, e:
-            self.log.warn("Failed to move things back, next step may fail")
+                self.applicationSpecificMoveAfter()
+            except EnvironmentError, e:
+                self.log.warn("Failed to move things back, next step may fail")
           
-        #now move all the new stuff that wasn't moved before
-        for item in os.listdir(os.getcwd()):
-            if item not in before_app_dir and item != os.path.basename(self.SteeringFile) and not os.path.isdir(item):        
-                try:
-                    shutil.move("./" + item, os.path.join(self.basedirectory, item) )
-                except EnvironmentError, why:
-                    self.log.error("Failed to move the file %s to the basedir" % item, str(why))
-            
-        #move the InputFile back too if it's here
-        for inf in self.InputFile:
-            localname = os.path.join("./", os.path.basename(inf))
-            if os.path.exists(localname):
-                try:
-                    shutil.move(localname, os.path.join(self.basedirectory, os.path.basename(inf)))
-                except EnvironmentError, why:
-                    self.log.error("Failed to move the input file back to the basedir", str(why))
+        with self.profile.phase("moveback"):
+            #now move all the new stuff that wasn't moved before
+            for item in changes['New']:
+                if self.streaming:
+                    break
+                if after_app_dir[item][ISDIR] or item == os.path.basename(self.SteeringFile):
+                    continue
+                if os.path.lexists(item):
+                    try:
+                        self.profile.addBytes(self.stager.move("./" + item, os.path.join(self.basedirectory, item)))
+                    except EnvironmentError, why:
+                        self.log.error("Failed to move the file %s to the basedir" % item, str(why))
+                
+            #move the InputFile back too if it's here
+            for inf in self.InputFile:
+                localname = os.path.join("./", os.path.basename(inf))
+                if inf in self._streamedInputs:
+                    os.remove(localname)
+                    continue
+                if os.path.exists(localname):
+                    try:
+                        self.profile.addBytes(self.stager.move(localname, 
+                                                               os.path.join(self.basedirectory, os.path.basename(inf))))
+                    except EnvironmentError, why:
+                        self.log.error("Failed to move the input file back to the basedir", str(why))
           
         ##Now we go back to the base directory
         os.chdir(self.basedirectory)
         
         self.log.verbose("We are now back to ", self.basedirectory)
-        self.listDir()
+        with self.profile.phase("listDir"):
+            self.listDir()
         
+        self.profile.staging = self.stager.getStats()
+        self.reportProfile()
+        return appres
+    
+    def getStepScheduler(self):
+        """ The L{StepScheduler} shared by the steps, None if the steps run one after the other
+        """
+        maxSteps = int(self.workflow_commons.get('ParallelSteps', 1))
+        if maxSteps < 2:
+            return None
+        if not self.workflow_commons.has_key('StepScheduler'):
+            maxSteps = min(maxSteps, self.ops.getValue('/Modules/ParallelSteps/MaxProcessors', 
+                                                       multiprocessing.cpu_count()))
+            self.workflow_commons['StepScheduler'] = StepScheduler(maxSteps)
+        return self.workflow_commons['StepScheduler']
+    
+    def getStepDependencies(self, stepName):
+        """ Names of the steps whose output is used by this step, from the StepDependencies workflow parameter
+        """
+        try:
+            dependencies = json.loads(self.workflow_commons.get('StepDependencies', '{}'))
+        except ValueError, why:
+            self.log.warn("Could not read the step dependencies:", str(why))
+            return []
+        return dependencies.get(stepName, [])
+    
+    def canRunInBackground(self):
+        """ The last step runs here so that the UserJobFinalization comes after it, and streams are handled by 
+        threads of this process, they cannot be used from a child process. A step whose output is used by the 
+        next step also runs here: the next step would wait for it right away.
+        """
+        if self.step_commons.get('StreamOutput', False):
+            return False
+        if self.workflow_commons.get('StreamingSteps'):
+            return False
+        stepNumber = int(self.step_commons.get('STEP_NUMBER', 0))
+        if stepNumber >= int(self.workflow_commons.get('TotalSteps', 0)):
+            return False
+        stepName = self.step_commons["STEP_DEFINITION_NAME"]
+        try:
+            dependencies = json.loads(self.workflow_commons.get('StepDependencies', '{}'))
+        except ValueError:
+            dependencies = {}
+        for nextStep, deps in dependencies.items():
+            #Step names end with the step number, see Job._addToWorkflow
+            if nextStep.endswith('_step_%s' % (stepNumber + 1)) and stepName in deps:
+                return False
+        return True
+    
+    def executeInBackground(self):
+        """ Run the step in a child process of the L{StepScheduler}
+        @return: the step result, and what the step changed in the workflow_commons
+        """
+        #Still the workflow_commons of the workflow process when it forked
+        snapshot = snapshotCommons(self.workflow_commons)
+        result = self.executeStep()
+        #The job parameters set with sendFlag = False would be lost with this process
+        jobReport = self.workflow_commons.get('JobReport')
+        if jobReport:
+            res = jobReport.commit()
+            if not res['OK']:
+                self.log.warn("Could not send the job parameters:", res['Message'])
+        return {'Result' : result, 'Commons' : getCommonsChanges(snapshot, self.workflow_commons)}
+    
+    def registerStreamConsumer(self, pid):
+        """ The application of this step reads the streamed input files: it is stopped if their producers fail
+        """
+        streams = self.workflow_commons.get('StreamingSteps', {})
+        for inf in self._streamedInputs:
+            if streams.has_key(inf):
+                streams[inf].setConsumer(pid)
+    
+    def waitForStreams(self, appres):
+        """ Wait for the applications of the previous steps streaming the input files of this step.
+        They are stopped if this step failed, and this step fails if they failed.
+        @param appres: result of L{runIt}
+        @return: appres, or S_ERROR() if a producer failed
+        """
+        streams = self.workflow_commons.get('StreamingSteps', {})
+        for inf in self._streamedInputs:
+            producer = streams.pop(inf, None)
+            if producer is None:
+                continue
+            if appres['OK'] or producer.isFailed():
+                producer.release()
+            else:
+                producer.abort()
+            res = producer.wait()
+            if not res['OK']:
+                self.log.error("Streaming of %s failed:" % inf, res['Message'])
+                if appres['OK']:
+                    appres = res
+            elif res['Value'] != 0 and not producer.aborted:
+                #Also when this step failed: it was stopped because of the producer
+                self.log.error("%s streaming %s exited with status %s" % (producer.stepName, inf, res['Value']))
+                self.log.error(producer.getStdError())
+                appres = S_ERROR('%s streaming %s Exited With Status %s' % (producer.stepName, inf, res['Value']))
         return appres
     
+    def addToManifest(self, snapshot, changes):
+        """ Record the files created or modified by this step in the OutputManifest of the workflow_commons,
+        used by the UserJobFinalization
+        @param snapshot: L{takeSnapshot} of the step directory after the application
+        @param changes: L{diffSnapshots} result
+        """
+        manifest = self.workflow_commons.setdefault('OutputManifest', {})
+        stepName = self.step_commons["STEP_DEFINITION_NAME"]
+        for status in ('New', 'Modified'):
+            for name in changes[status]:
+                entry = snapshot[name]
+                if entry[ISDIR]:
+                    continue
+                manifest[name] = {'Step' : stepName, 'Status' : status, 'Size' : entry[SIZE], 'MTime' : entry[MTIME]}
+                if self.renamedOutputs.has_key(name):
+                    manifest[name]['Declared'] = self.renamedOutputs[name]
+    
+    def reportProfile(self):
+        """ Set the step profile as job parameter, and keep it for the UserJobFinalization
+        """
+        self.workflow_commons.setdefault('StepProfiles', []).append(self.profile.toDict())
+        if self.jobReport:
+            result = self.jobReport.setJobParameter('Profile_%s' % self.profile.stepName, self.profile.toJSON(), 
+                                                    sendFlag = False)
+            if not result['OK']:
+                self.log.warn("Could not set the step profile:", result['Message'])
+    
     def listDir(self):
         """ List the current directories content
         """
@@ -511,15 +717,28 @@ class ModuleBase(object):
     
     def redirectLogOutput(self, fd, message):
         """Catch the output from the application
+        
+        The log file stays open in the L{logSink} until the end of runIt.
         """
-        sys.stdout.flush()
         if message:
             print message
         if self.applicationLog:
-            log = open(self.applicationLog, 'a')
-            log.write(message+'\n')
-            log.close()
+            if not self.logSink.isOpen(self.applicationLog):
+                self.logSink.open(self.applicationLog)
+            self.logSink.write(message+'\n')
         else:
             self.log.error("Application Log file not defined")
         if fd == 1:
-            self.stdError += message      
+            self.logSink.addStdError(message)
+    
+    def _getStdError(self):
+        """ The end of the application standard error, kept by the L{logSink}
+        """
+        return self.logSink.getStdError()
+    
+    def _setStdError(self, stdError):
+        """ Reset the standard error kept by the L{logSink}
+        """
+        self.logSink.setStdError(stdError)
+    
+    stdError = property(_getStdError, _setStdError)
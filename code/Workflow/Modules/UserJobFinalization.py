@@ -13,19 +13,24 @@ __RCSID__ = "$Id: UserJobFinalization.py 71836 2013-11-20 13:47:14Z sposs $"
 
 from DIRAC.DataManagementSystem.Client.ReplicaManager      import ReplicaManager
 from DIRAC.DataManagementSystem.Client.FailoverTransfer    import FailoverTransfer
+from DIRAC.RequestManagementSystem.Client.Request          import Request
 
-from DIRAC.Core.Security.ProxyInfo                         import getVOfromProxyGroup,\
-    getProxyInfo
+from DIRAC.Core.Security.ProxyInfo                         import getVOfromProxyGroup
+from Core.Utilities.ProxyInfoCache                         import getProxyInfo
 from DIRAC.Core.Utilities.File import getGlobbedFiles
 
 
 from Workflow.Modules.ModuleBase                         import ModuleBase
+from Workflow.Utilities.UploadScheduler                  import UploadScheduler
+from Core.Utilities.ThreadedMap                          import threadedMap
+from Workflow.Utilities.StepProfile                      import combineProfiles
+from Workflow.Utilities.DirectorySnapshot                import takeSnapshot, ISDIR
 from ALDIRAC.Core.Utilities.OutputData                   import constructUserLFNs ## this is going to be missing
 
 
 from DIRAC                                                 import S_OK, S_ERROR, gLogger, gConfig
 
-import os, random, time
+import os, random, time, threading, json, fnmatch
 
 class UserJobFinalization(ModuleBase):
     """ User Job finalization: takes care of uploading the output data to the specified storage elements
@@ -52,6 +57,11 @@ class UserJobFinalization(ModuleBase):
         self.userOutputSE = ''
         self.userOutputPath = ''
         self.jobReport = None
+        seLimits = self.ops.getOptionsDict('/UserJobs/Upload/SELimits')
+        self.uploadScheduler = UploadScheduler(maxTransfers = self.ops.getValue('/UserJobs/Upload/MaxTransfers', 4),
+                                               maxPerSE = self.ops.getValue('/UserJobs/Upload/MaxTransfersPerSE', 2),
+                                               seLimits = seLimits['OK'] and seLimits['Value'] or {})
+        self._requestLock = threading.Lock()
       
     #############################################################################
     def applicationSpecificInputs(self):
@@ -94,6 +104,21 @@ class UserJobFinalization(ModuleBase):
         return S_OK('Parameters resolved')
     
     #############################################################################
+    def getManifestFiles(self, manifest, pattern):
+        """ Files of the OutputManifest matching a user output data pattern, by their name or by the
+        name they were declared with before being renamed, and still in the job directory
+        @param manifest: OutputManifest of the workflow_commons
+        @param pattern: file name pattern, without directory
+        @return: sorted list of file names
+        """
+        files = []
+        for name, entry in manifest.items():
+            if pattern.startswith('.') or not name.startswith('.'):
+                if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(entry.get('Declared', ''), pattern):
+                    if os.path.isfile(name):
+                        files.append(name)
+        return sorted(files)
+    
     def execute(self):
         """ Main execution function.
         """
@@ -112,11 +137,30 @@ class UserJobFinalization(ModuleBase):
             #Not last step, do nothing, proceed happily.
             return S_OK()
         
+        #A streamed output that no step read: stop its application
+        for outputFile, producer in self.workflow_commons.get('StreamingSteps', {}).items():
+            self.log.warn("%s was streamed but never read, stopping %s" % (outputFile, producer.stepName))
+            producer.abort()
+            producer.wait()
+        self.workflow_commons['StreamingSteps'] = {}
+
+        #Steps running in the background: their outputs and profiles are needed below
+        scheduler = self.getStepScheduler()
+        if scheduler:
+            result = scheduler.waitAll(self.workflow_commons)
+            if not result['OK']:
+                self.log.error("Steps running in the background failed:", result['Message'])
+                self.setApplicationStatus(result['Message'])
+                return result
+
         result = self.resolveInputVariables()
         if not result['OK']:
             self.log.error("Failed to resolve input parameters:", result['Message'])
             return result
         
+        #All the steps ran: report their combined profile
+        self.reportJobProfile()
+        
         self.log.info('Initializing %s' % self.version)
         if not self.workflowStatus['OK'] or not self.stepStatus['OK']:
             ##Something went wrong in the step or the workflow, do nothing.
@@ -136,16 +180,34 @@ class UserJobFinalization(ModuleBase):
         #workflow and all the parameters needed to upload them.
         outputList = []
         possible_files= []
+        seen = set()
+        #The steps recorded what they produced: the job directory is only listed, once for all
+        #the patterns, when a pattern matches nothing in the OutputManifest
+        jobDir = None
+        manifest = self.workflow_commons.get('OutputManifest', {})
         for i in self.userOutputData:
-            files = getGlobbedFiles(i)
+            files = []
+            if not i.count('/'):
+                files = self.getManifestFiles(manifest, i)
+            if not files:
+                if jobDir is None:
+                    jobDir = takeSnapshot(os.getcwd())
+                files = [name for name in fnmatch.filter(sorted(jobDir), i) if i.startswith('.') or not name.startswith('.')]
+                if i.count('/') or [name for name in files if jobDir[name][ISDIR]]:
+                    #Paths and directories are resolved as before
+                    files = getGlobbedFiles(i)
             for possible_file in files:
-                if possible_file in possible_files:
+                if os.path.basename(possible_file) in seen:
                     #Don't have twice the same file
                     continue
                 outputList.append({'outputDataType' : i.split('.')[-1].upper(),#this would be used to sort the files in different dirs
                                    'outputDataSE' : self.userOutputSE,
                                    'outputFile' : os.path.basename(possible_file)})
                 possible_files.append(os.path.basename(possible_file))
+                seen.add(os.path.basename(possible_file))
+                if manifest.has_key(os.path.basename(possible_file)):
+                    self.log.verbose('%s was produced by %s' % (possible_file, 
+                                                               manifest[os.path.basename(possible_file)]['Step']))
                 
         self.log.info('Constructing user output LFN(s) for %s' % (', '.join(self.userOutputData)))
         if not self.jobID:
@@ -219,27 +281,25 @@ to upload the following files %s' % ', '.join(final.keys()))
             
             return S_OK('Module is disabled by control flag')
         
-        #Instantiate the failover transfer client with the global request object
-        failoverTransfer = FailoverTransfer(self.request)
-        
-        #One by one upload the files with failover if necessary
+        #Upload the files concurrently with failover if necessary.
+        #Every transfer has its own request, they are merged in the global request object afterwards.
         replication = {}
         failover = {}
         uploaded = []
         if not self.failoverTest:
-            for fileName, metadata in final.items():
+            transfers = final.items()
+            for fileName, metadata in transfers:
                 self.log.info("Attempting to store file %s to the following SE(s):\n%s" % (fileName, 
                                                                                            ', '.join(metadata['resolvedSE'])))
+            results = self.uploadScheduler.run(self._transferAndRegisterFile, transfers)
+            for (fileName, metadata), result in zip(transfers, results):
                 replicateSE = ''
-                result = failoverTransfer.transferAndRegisterFile(fileName, metadata['localpath'], metadata['lfn'],
-                                                                  metadata['resolvedSE'], fileMetaDict = metadata, 
-                                                                  fileCatalog = self.userFileCatalog)
+                lfn = metadata['lfn']
                 if not result['OK']:
                     self.log.error('Could not transfer and register %s with metadata:\n %s' % (fileName, metadata))
                     failover[fileName] = metadata
                 else:
                     #Only attempt replication after successful upload
-                    lfn = metadata['lfn']
                     uploaded.append(lfn)          
                     seList = metadata['resolvedSE']
                     
@@ -257,17 +317,15 @@ to upload the following files %s' % ', '.join(final.keys()))
             failover = final
         
         cleanUp = False
+        transfers = []
         for fileName, metadata in failover.items():
-            random.shuffle(self.failoverSEs)
+            failoverSEs = list(self.failoverSEs)
+            random.shuffle(failoverSEs)
             targetSE = metadata['resolvedSE'][0]
-            metadata['resolvedSE'] = self.failoverSEs
-            result = failoverTransfer.transferAndRegisterFileFailover(fileName,
-                                                                      metadata['localpath'],
-                                                                      metadata['lfn'],
-                                                                      targetSE,
-                                                                      self.failoverSEs,
-                                                                      fileMetaDict = metadata,
-                                                                      fileCatalog = self.userFileCatalog)
+            metadata['resolvedSE'] = failoverSEs
+            transfers.append((fileName, metadata, targetSE))
+        results = self.uploadScheduler.run(self._transferAndRegisterFileFailover, transfers)
+        for (fileName, metadata, _targetSE), result in zip(transfers, results):
             if not result['OK']:
                 self.log.error('Could not transfer and register %s with metadata:\n %s' % (fileName, metadata))
                 cleanUp = True
@@ -281,8 +339,6 @@ to upload the following files %s' % ', '.join(final.keys()))
             report = ', '.join( uploaded )
             self.jobReport.setJobParameter( 'UploadedOutputData', report )
         
-        self.request = failoverTransfer.request
-        
         #If some or all of the files failed to be saved to failover
         if cleanUp:
             self.workflow_commons['Request'] = self.request
@@ -291,20 +347,113 @@ to upload the following files %s' % ', '.join(final.keys()))
             return S_ERROR('Failed To Upload Output Data')
         
         #If there is now at least one replica for uploaded files can trigger replication
-        rm = ReplicaManager()
-        self.log.info('Sleeping for 10 seconds before attempting replication of recently uploaded files')
-        time.sleep(10)
-        for lfn, repSE in replication.items():
-            result = rm.replicateAndRegister(lfn, repSE, catalog = self.userFileCatalog)
-            if not result['OK']:
-                self.log.info('Replication failed with below error but file already exists in Grid storage with \
-                at least one replica:\n%s' % (result))
+        if replication:
+            rm = self._getReplicaManager()
+            self.log.info('Waiting for the recently uploaded files to be visible before attempting replication')
+            self._waitForReplicas(rm, replication.keys())
+            replications = replication.items()
+            results = threadedMap(lambda rep: rm.replicateAndRegister(rep[0], rep[1], catalog = self.userFileCatalog),
+                                  replications, self.ops.getValue('/UserJobs/Replication/MaxReplications', 4))
+            for result in results:
+                if not result['OK']:
+                    self.log.info('Replication failed with below error but file already exists in Grid storage with \
+                    at least one replica:\n%s' % (result))
         
         self.workflow_commons['Request'] = self.request
         self.generateFailoverFile()    
         
         self.setApplicationStatus('Job Finished Successfully')
         return S_OK('Output data uploaded')
+    
+    #############################################################################
+    def reportJobProfile(self):
+        """ Combine the profiles of all the steps, see L{ModuleBase.reportProfile}, and set them as job parameter
+        """
+        if not self.workflow_commons.get('StepProfiles'):
+            return S_OK()
+        profile = combineProfiles(self.workflow_commons['StepProfiles'])
+        result = self.jobReport.setJobParameter('JobProfile', json.dumps(profile, separators = (',', ':'), 
+                                                                         sort_keys = True))
+        if not result['OK']:
+            self.log.warn("Could not set the job profile:", result['Message'])
+        return result
+    
+    def _waitForReplicas(self, rm, lfns):
+        """ Poll the catalog until all the lfns have a replica, with an exponential backoff.
+        Gives up after /UserJobs/Replication/MaxWait seconds, the replication is tried anyway.
+        """
+        lfns = list(lfns)
+        delay = self.ops.getValue('/UserJobs/Replication/FirstPollDelay', 0.5)
+        maxDelay = self.ops.getValue('/UserJobs/Replication/MaxPollDelay', 5.)
+        deadline = time.time() + self.ops.getValue('/UserJobs/Replication/MaxWait', 30.)
+        while True:
+            result = rm.getReplicas(lfns)
+            if result['OK']:
+                lfns = [lfn for lfn in lfns if not result['Value']['Successful'].get(lfn)]
+                if not lfns:
+                    return S_OK()
+            if time.time() + delay > deadline:
+                self.log.warn('Replicas still not visible, trying anyway:', ', '.join(lfns))
+                return S_ERROR('Replicas not visible')
+            time.sleep(delay)
+            delay = min(delay * 2, maxDelay)
+    
+    def _getReplicaManager(self):
+        """ Return the client used to look for and create replicas
+        """
+        return ReplicaManager()
+    
+    def _getFailoverTransfer(self, request):
+        """ Return the transfer client, uses the given request for the deferred operations
+        
+        One client per transfer: the transfers run in several threads, and the clients (with their 
+        ReplicaManager) are not meant to be shared between threads.
+        """
+        return FailoverTransfer(request)
+    
+    def _transferAndRegisterFile(self, transfer):
+        """ Upload one file to the first SE that works among the resolvedSE. Called by the upload scheduler.
+        
+        The SEs are tried one by one here rather than in FailoverTransfer, to respect the limit of each SE.
+        """
+        fileName, metadata = transfer
+        failoverTransfer = self._getFailoverTransfer(Request())
+        result = S_ERROR('No SE to upload %s to' % fileName)
+        for se in metadata['resolvedSE']:
+            result = self.uploadScheduler.runOnSE(se, failoverTransfer.transferAndRegisterFile, fileName, 
+                                                  metadata['localpath'], metadata['lfn'], [se], 
+                                                  fileMetaDict = metadata, fileCatalog = self.userFileCatalog)
+            if result['OK']:
+                break
+            self.log.warn('Could not upload %s to %s:' % (fileName, se), result['Message'])
+        self._mergeRequest(failoverTransfer.request)
+        return result
+    
+    def _transferAndRegisterFileFailover(self, transfer):
+        """ Upload one file to a failover SE, with a request to move it to its target SE. Called by the upload scheduler.
+        """
+        fileName, metadata, targetSE = transfer
+        failoverTransfer = self._getFailoverTransfer(Request())
+        result = S_ERROR('No failover SE to upload %s to' % fileName)
+        for se in metadata['resolvedSE']:
+            result = self.uploadScheduler.runOnSE(se, failoverTransfer.transferAndRegisterFileFailover, fileName,
+                                                  metadata['localpath'], metadata['lfn'], targetSE, [se],
+                                                  fileMetaDict = metadata, fileCatalog = self.userFileCatalog)
+            if result['OK']:
+                break
+            self.log.warn('Could not upload %s to the failover SE %s:' % (fileName, se), result['Message'])
+        self._mergeRequest(failoverTransfer.request)
+        return result
+    
+    def _mergeRequest(self, request):
+        """ Move the operations of a transfer request to the global request object
+        """
+        self._requestLock.acquire()
+        try:
+            for operation in list(request):
+                self.request.addOperation(operation)
+        finally:
+            self._requestLock.release()
 
 #############################################################################
 def getCurrentOwner():
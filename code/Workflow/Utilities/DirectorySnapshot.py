@@ -0,0 +1,63 @@
+'''
+Snapshot of the content of a directory, to find the files an application created or modified.
+
+Every entry is read once, with scandir when the scandir module is installed, with listdir and lstat
+otherwise. The differences are computed with sets, so the cost stays linear in the number of files.
+
+>>> before = takeSnapshot('.')
+>>> runIt()
+>>> after = takeSnapshot('.')
+>>> diffSnapshots(before, after)
+{'New': ['out.slcio', 'app.log'], 'Modified': ['steering.xml']}
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+import os, stat
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+#: Position of the fields in the snapshot entries
+INODE, SIZE, MTIME, ISDIR = range(4)
+
+def takeSnapshot(path = '.'):
+    """ Read the entries of a directory, not recursively. Symbolic links are not followed.
+
+    @param path: directory to read
+    @return: {name: (inode, size, mtime, isdir)}
+    """
+    snapshot = {}
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                info = entry.stat(follow_symlinks = False)
+            except OSError:
+                #Removed while reading the directory
+                continue
+            snapshot[entry.name] = (info.st_ino, info.st_size, info.st_mtime, stat.S_ISDIR(info.st_mode))
+        return snapshot
+    for name in os.listdir(path):
+        try:
+            info = os.lstat(os.path.join(path, name))
+        except OSError:
+            continue
+        snapshot[name] = (info.st_ino, info.st_size, info.st_mtime, stat.S_ISDIR(info.st_mode))
+    return snapshot
+
+def diffSnapshots(before, after):
+    """ Entries created or modified between two snapshots. An entry is modified if its inode, size or
+    modification time changed.
+
+    @param before: L{takeSnapshot} result
+    @param after: L{takeSnapshot} result
+    @return: {'New': sorted names, 'Modified': sorted names}
+    """
+    beforeNames = set(before)
+    afterNames = set(after)
+    modified = [name for name in afterNames & beforeNames if after[name][:ISDIR] != before[name][:ISDIR]]
+    return {'New' : sorted(afterNames - beforeNames), 'Modified' : sorted(modified)}
@@ -0,0 +1,64 @@
+'''
+Size and checksums of output files, computed in a single read of each file, several files at a time.
+
+Used by L{ModuleBase.getFileMetadata}.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from Core.Utilities.ThreadedMap           import threadedMap
+from DIRAC.Core.Utilities.Adler           import intAdlerToHex
+from DIRAC                                import S_OK, S_ERROR
+
+import hashlib, zlib
+
+#: Size of the reads
+BLOCK_SIZE = 4194304
+
+def getChecksums(fileName, digests = None, blockSize = BLOCK_SIZE):
+    """ Read the file once to get its size, adler32 and any other hashlib digests
+
+    @param fileName: file to read
+    @param digests: hashlib algorithm names, e.g. ['md5']
+    @return: S_OK({'Size': size, 'Addler': adler, 'Digests': {'md5': hexdigest}})
+    """
+    hashes = {}
+    for digest in digests or []:
+        hashes[digest] = hashlib.new(digest)
+    adler = 1
+    size = 0
+    try:
+        inputFile = open(fileName, 'rb')
+        try:
+            while True:
+                data = inputFile.read(blockSize)
+                if not data:
+                    break
+                size += len(data)
+                adler = zlib.adler32(data, adler)
+                for hashobj in hashes.values():
+                    hashobj.update(data)
+        finally:
+            inputFile.close()
+    except EnvironmentError, why:
+        return S_ERROR("Failed to read %s: %s" % (fileName, str(why)))
+    return S_OK({'Size' : size, 'Addler' : intAdlerToHex(adler),
+                 'Digests' : dict([(name, hashobj.hexdigest()) for name, hashobj in hashes.items()])})
+
+def getFilesChecksums(fileNames, digests = None, maxThreads = 4):
+    """ Call L{getChecksums} for all the files, reading up to maxThreads files concurrently
+
+    @return: S_OK({'Successful': {fileName: checksums}, 'Failed': {fileName: message}})
+    """
+    fileNames = list(fileNames)
+    results = threadedMap(lambda fileName: getChecksums(fileName, digests), fileNames, maxThreads)
+    successful = {}
+    failed = {}
+    for fileName, result in zip(fileNames, results):
+        if result['OK']:
+            successful[fileName] = result['Value']
+        else:
+            failed[fileName] = result['Message']
+    return S_OK({'Successful' : successful, 'Failed' : failed})
@@ -0,0 +1,99 @@
+'''
+Buffered writer for the application logs, used by L{ModuleBase.redirectLogOutput}.
+
+The log file is kept open while the application runs and flushed every flushInterval seconds or every
+flushSize bytes, instead of being opened and closed for every line. Only the last stdErrorSize bytes
+of the standard error are kept in memory.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from collections import deque
+import sys, time
+
+class LogSink(object):
+    """ Write the lines of an application output to its log file, and keep the end of the standard error
+    """
+    def __init__(self, bufferSize = 1048576, flushInterval = 5., flushSize = 1048576, stdErrorSize = 65536):
+        """
+        @param bufferSize: buffer size of the log file, in bytes
+        @param flushInterval: seconds after which the log is flushed
+        @param flushSize: bytes written after which the log is flushed
+        @param stdErrorSize: number of bytes of the standard error to keep
+        """
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self.flushSize = flushSize
+        self.stdErrorSize = stdErrorSize
+        self.fileName = ''
+        self._file = None
+        self._pending = 0
+        self._lastFlush = time.time()
+        self._stdError = deque()
+        self._stdErrorLength = 0
+
+    def open(self, fileName):
+        """ Open the log file in append mode. The previously open file, if any, is closed.
+        """
+        self.close()
+        self._file = open(fileName, 'a', self.bufferSize)
+        self.fileName = fileName
+        self._lastFlush = time.time()
+
+    def isOpen(self, fileName):
+        """ Check that the given file is the one being written
+        """
+        return self._file is not None and self.fileName == fileName
+
+    def write(self, message):
+        """ Write to the log file, flush if needed
+        """
+        self._file.write(message)
+        self._pending += len(message)
+        if self._pending >= self.flushSize or time.time() - self._lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        """ Flush the log file and the standard output
+        """
+        sys.stdout.flush()
+        if self._file is not None:
+            self._file.flush()
+        self._pending = 0
+        self._lastFlush = time.time()
+
+    def close(self):
+        """ Flush and close the log file
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+        self.fileName = ''
+
+    def addStdError(self, message):
+        """ Keep the message, dropping the oldest ones to stay below stdErrorSize
+        """
+        self._stdError.append(message)
+        self._stdErrorLength += len(message)
+        while self._stdErrorLength > self.stdErrorSize and len(self._stdError) > 1:
+            self._stdErrorLength -= len(self._stdError.popleft())
+
+    def getStdError(self):
+        """ Return the end of the standard error, at most stdErrorSize bytes
+        """
+        stdError = ''.join(self._stdError)
+        if len(stdError) > self.stdErrorSize:
+            stdError = stdError[-self.stdErrorSize:]
+        return stdError
+
+    def setStdError(self, stdError):
+        """ Replace the kept standard error
+        """
+        self._stdError.clear()
+        self._stdErrorLength = 0
+        if stdError:
+            self.addStdError(stdError)
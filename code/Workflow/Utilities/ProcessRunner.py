@@ -0,0 +1,118 @@
+'''
+Run an application directly from its argument list, streaming its output line by line.
+
+Unlike L{DIRAC.Core.Utilities.Subprocess.shellCall}, no shell is involved: the arguments are passed as
+they are and the environment is given explicitly. The output is not kept in memory, every line is given
+to the callback as soon as it is complete, with the same convention as shellCall: fd 0 for the standard
+output and fd 1 for the standard error.
+
+>>> res = runCommand(['./script.sh', 'a file'], env = {'PATH' : '/bin'}, callbackFunction = log)
+>>> status = res['Value']
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from DIRAC import S_OK, S_ERROR
+
+import os, errno, fcntl, select, subprocess, multiprocessing
+
+#: Size of the reads on the pipes
+READ_SIZE = 65536
+
+def _setNonBlocking(fd):
+    """ Reads on the pipe return what is available instead of waiting for more
+    """
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+def runCommand(argv, env = None, callbackFunction = None, cwd = None, onStart = None, newProcessGroup = False):
+    """ Execute argv and wait for it to finish
+
+    If the executable cannot be started, the reason is given to the callback as standard error and the
+    status is the one a shell would return: 127 if it is not found, 126 otherwise. A process killed by
+    signal N has the status 128 + N.
+    Unlike with a shell, a script without #! line cannot be executed (status 126): run it with its
+    interpreter.
+
+    @param argv: list of arguments, the first one is the executable
+    @param env: environment of the process, the current one if None
+    @param callbackFunction: called as callbackFunction(fd, line) for every line of output
+    @param cwd: working directory of the process
+    @param onStart: called with the pid of the process once it is started
+    @param newProcessGroup: start the process in its own process group, so it can be stopped with all its children
+    @return: S_OK(exit status) or S_ERROR()
+    """
+    try:
+        process = subprocess.Popen(argv, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                   env = env, cwd = cwd, close_fds = True,
+                                   preexec_fn = newProcessGroup and os.setpgrp or None)
+    except OSError, why:
+        if callbackFunction:
+            callbackFunction(1, "%s: %s" % (argv[0], why.strerror))
+        if why.errno == errno.ENOENT:
+            return S_OK(127)
+        return S_OK(126)
+    except ValueError, why:
+        return S_ERROR("Cannot execute %s: %s" % (argv, str(why)))
+
+    if onStart:
+        onStart(process.pid)
+    pipes = {process.stdout.fileno() : 0, process.stderr.fileno() : 1}
+    pending = {}
+    for fd in pipes.keys():
+        _setNonBlocking(fd)
+        pending[fd] = ''
+    while pipes:
+        try:
+            ready = select.select(pipes.keys(), [], [])[0]
+        except select.error, why:
+            if why.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in ready:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except OSError, why:
+                if why.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            if not data:
+                if pending[fd] and callbackFunction:
+                    callbackFunction(pipes[fd], pending[fd])
+                del pipes[fd]
+                continue
+            lines = (pending[fd] + data).split('\n')
+            pending[fd] = lines.pop()
+            if callbackFunction:
+                for line in lines:
+                    callbackFunction(pipes[fd], line)
+    process.stdout.close()
+    process.stderr.close()
+    status = process.wait()
+    if status < 0:
+        #Killed by a signal, reported like a shell does
+        status = 128 - status
+    return S_OK(status)
+
+def getAllocatedProcessors():
+    """ Number of processors this process may run on: the ones of its CPU affinity (set by the batch system 
+    on multi-core slots), all the processors of the node if it is not known
+    """
+    try:
+        statusFile = open('/proc/self/status')
+        try:
+            for line in statusFile:
+                if not line.startswith('Cpus_allowed_list:'):
+                    continue
+                count = 0
+                for cpus in line.split(':', 1)[1].strip().split(','):
+                    first, _, last = cpus.partition('-')
+                    count += int(last or first) - int(first) + 1
+                return count
+        finally:
+            statusFile.close()
+    except (EnvironmentError, ValueError):
+        pass
+    return multiprocessing.cpu_count()
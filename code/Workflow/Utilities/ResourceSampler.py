@@ -0,0 +1,183 @@
+'''
+Background sampling of the resources used by a process and all its descendants, read from /proc.
+
+>>> sampler = ResourceSampler(interval = 5.)
+>>> sampler.start(pid)
+>>> ... wait for the process ...
+>>> sampler.stop()
+>>> sampler.getSummary()
+{'Samples': 120, 'Wall': 600.2, 'CPU': 590.1, 'PeakRSS': 2147483648, 'ReadBytes': 104857600,
+ 'WriteBytes': 52428800, 'PeakThreads': 4, 'PeakProcesses': 2}
+
+The I/O of a process is counted with the last values seen before it exited, so a process living less than
+the interval is missed. The CPU time is also taken from os.times once the process was waited for, so it is
+complete when L{stop} is called after the end of the process. That is only right if no other child process
+ends meanwhile: give useChildrenTimes = False when several processes are sampled at the same time. Where
+/proc is not available, the summary only contains the wall and CPU times.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+import os, time, threading
+
+#: Clock ticks per second, for the CPU times in /proc/<pid>/stat
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+#: Memory page size, for the RSS in /proc/<pid>/stat
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def _readStat(pid):
+    """ Parent pid, CPU seconds, threads and RSS bytes of a process, from /proc/<pid>/stat
+    @return: tuple or None if the process is gone
+    """
+    try:
+        statFile = open('/proc/%s/stat' % pid)
+        try:
+            content = statFile.read()
+        finally:
+            statFile.close()
+    except EnvironmentError:
+        return None
+    #The command name is between parentheses and can contain spaces
+    fields = content[content.rfind(')') + 2:].split()
+    ppid = int(fields[1])
+    cpu = (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+    threads = int(fields[17])
+    rss = int(fields[21]) * PAGE_SIZE
+    return ppid, cpu, threads, rss
+
+def _readIO(pid):
+    """ Bytes read and written by a process, from /proc/<pid>/io
+    @return: (read bytes, written bytes), (0, 0) if not readable
+    """
+    values = {}
+    try:
+        ioFile = open('/proc/%s/io' % pid)
+        try:
+            for line in ioFile:
+                key, _, value = line.partition(':')
+                values[key] = int(value)
+        finally:
+            ioFile.close()
+    except (EnvironmentError, ValueError):
+        return 0, 0
+    return values.get('read_bytes', 0), values.get('write_bytes', 0)
+
+class ResourceSampler(object):
+    """ Sample a process tree every interval seconds in a daemon thread
+    """
+    def __init__(self, interval = 5., useChildrenTimes = True):
+        """
+        @param interval: seconds between two samples
+        @param useChildrenTimes: also take the CPU time of the children of this process from os.times
+        """
+        self.interval = interval
+        self.useChildrenTimes = useChildrenTimes
+        self.pid = None
+        self.samples = 0
+        self.peakRSS = 0
+        self.peakThreads = 0
+        self.peakProcesses = 0
+        self._cpu = {}
+        self._io = {}
+        self._start = None
+        self._end = None
+        self._childrenCPU = None
+        self._stopEvent = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, pid):
+        """ Start sampling pid and its descendants. Can be given as onStart to L{runCommand}.
+        """
+        self.pid = pid
+        self._start = time.time()
+        if self.useChildrenTimes:
+            self._childrenCPU = sum(os.times()[2:4])
+        if not os.path.isdir('/proc/%s' % pid):
+            return
+        self._thread = threading.Thread(target = self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop sampling, wait for the sampling thread to end
+        """
+        self._end = time.time()
+        if self._childrenCPU is not None:
+            self._childrenCPU = sum(os.times()[2:4]) - self._childrenCPU
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.sample()
+            self._stopEvent.wait(self.interval)
+            if self._stopEvent.isSet():
+                break
+
+    def _getTree(self):
+        """ Stats of the process and its descendants, by pid
+        """
+        stats = {}
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            stat = _readStat(entry)
+            if stat is None:
+                continue
+            stats[int(entry)] = stat
+            children.setdefault(stat[0], []).append(int(entry))
+        tree = {}
+        toVisit = [self.pid]
+        while toVisit:
+            pid = toVisit.pop()
+            if stats.has_key(pid):
+                tree[pid] = stats[pid]
+                toVisit.extend(children.get(pid, []))
+        return tree
+
+    def sample(self):
+        """ Take one sample of the process tree
+        """
+        tree = self._getTree()
+        if not tree:
+            return
+        self._lock.acquire()
+        try:
+            self.samples += 1
+            self.peakRSS = max(self.peakRSS, sum([stat[3] for stat in tree.values()]))
+            self.peakThreads = max(self.peakThreads, sum([stat[2] for stat in tree.values()]))
+            self.peakProcesses = max(self.peakProcesses, len(tree))
+            for pid, stat in tree.items():
+                self._cpu[pid] = stat[1]
+                self._io[pid] = _readIO(pid)
+        finally:
+            self._lock.release()
+
+    def getSummary(self):
+        """ Resources used so far, the sizes are in bytes and the times in seconds
+        @return: dict
+        """
+        self._lock.acquire()
+        try:
+            end = self._end or time.time()
+            summary = {'Samples' : self.samples, 'Wall' : round(end - (self._start or end), 3)}
+            cpu = sum(self._cpu.values())
+            if self._end and self._childrenCPU is not None:
+                cpu = max(cpu, self._childrenCPU)
+            summary['CPU'] = round(cpu, 3)
+            if self.samples:
+                summary.update({'PeakRSS' : self.peakRSS,
+                                'ReadBytes' : sum([values[0] for values in self._io.values()]),
+                                'WriteBytes' : sum([values[1] for values in self._io.values()]),
+                                'PeakThreads' : self.peakThreads,
+                                'PeakProcesses' : self.peakProcesses})
+            return summary
+        finally:
+            self._lock.release()
@@ -0,0 +1,161 @@
+'''
+Zero-copy staging of files and directories between the job directory and the step directories.
+
+Moves are renames when source and destination are on the same file system. Trees like lib are hard linked
+(or symbolically linked) instead of copied, and files that must be copied are cloned (reflink) where the
+file system supports it. Only when none of this is possible, e.g. across devices, the data is copied.
+
+>>> stager = Stager(libMode = 'hardlink')
+>>> stager.stageTree('/job/lib', './lib')
+0
+>>> stager.move('/job/input.slcio', './input.slcio')
+0
+>>> stager.getStats()
+{'Copied': 0, 'Linked': 2147483648, 'Renamed': 1048576}
+
+All the methods return the number of bytes actually copied.
+
+Hard linked files share their content with the source: an application modifying a library file in place
+modifies it for the following steps too. Use libMode = 'copy' if that is a problem.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+import os, errno, fcntl, shutil, stat
+
+#: Linux ioctl cloning a file (reflink), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+#: Ways of staging a tree
+LIB_MODES = ['hardlink', 'symlink', 'copy']
+
+def getTreeSize(path):
+    """ Size of a file, or of all the files in a directory tree. Symbolic links are not followed.
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        return info.st_size
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.lstat(os.path.join(dirpath, filename)).st_size
+    return total
+
+class Stager(object):
+    """ Stage files and trees, counting the bytes copied, linked and renamed
+    """
+    def __init__(self, libMode = 'hardlink', reflink = True):
+        """
+        @param libMode: how L{stageTree} stages a tree, one of L{LIB_MODES}
+        @param reflink: try to clone the files before copying them
+        """
+        if not libMode in LIB_MODES:
+            libMode = 'copy'
+        self.libMode = libMode
+        self.reflink = reflink
+        self.copied = 0
+        self.linked = 0
+        self.renamed = 0
+
+    def _clone(self, src, dst):
+        """ Clone src to dst, the data is shared until one of them is modified
+        @return: True if dst was created
+        """
+        srcFile = open(src, 'rb')
+        try:
+            dstFile = open(dst, 'wb')
+            try:
+                fcntl.ioctl(dstFile.fileno(), FICLONE, srcFile.fileno())
+                cloned = True
+            except IOError, why:
+                cloned = False
+                if why.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+                    #Not supported by this file system, do not try again
+                    self.reflink = False
+            dstFile.close()
+        finally:
+            srcFile.close()
+        if not cloned:
+            os.remove(dst)
+            return False
+        shutil.copystat(src, dst)
+        return True
+
+    def copyFile(self, src, dst):
+        """ Clone or copy a file, with its permissions and times
+        @return: bytes copied
+        """
+        size = os.path.getsize(src)
+        if self.reflink and self._clone(src, dst):
+            self.linked += size
+            return 0
+        shutil.copy2(src, dst)
+        self.copied += size
+        return size
+
+    def move(self, src, dst):
+        """ Rename src to dst, like shutil.move but counting the bytes copied when it cannot be a rename
+        @return: bytes copied
+        """
+        size = getTreeSize(src)
+        try:
+            os.rename(src, dst)
+            self.renamed += size
+            return 0
+        except OSError, why:
+            if why.errno != errno.EXDEV:
+                #e.g. dst is an existing directory: moved into it, as before
+                shutil.move(src, dst)
+                self.renamed += size
+                return 0
+        if os.path.isdir(src) and not os.path.islink(src):
+            copied = self.stageTree(src, dst, 'copy')
+            shutil.rmtree(src)
+            return copied
+        copied = self.copyFile(src, dst)
+        os.remove(src)
+        return copied
+
+    def stageTree(self, src, dst, mode = None):
+        """ Make the content of the src directory available as dst
+        @param mode: one of L{LIB_MODES}, libMode by default. Files that cannot be hard linked are copied.
+        @return: bytes copied
+        """
+        mode = mode or self.libMode
+        if mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+            self.linked += getTreeSize(src)
+            return 0
+        copied = 0
+        for dirpath, dirnames, filenames in os.walk(src):
+            target = os.path.join(dst, os.path.relpath(dirpath, src))
+            os.makedirs(target)
+            shutil.copystat(dirpath, target)
+            for dirname in list(dirnames):
+                if os.path.islink(os.path.join(dirpath, dirname)):
+                    #Not followed by os.walk: keep the link
+                    os.symlink(os.readlink(os.path.join(dirpath, dirname)), os.path.join(target, dirname))
+                    dirnames.remove(dirname)
+            for filename in filenames:
+                srcFile = os.path.join(dirpath, filename)
+                dstFile = os.path.join(target, filename)
+                if os.path.islink(srcFile):
+                    os.symlink(os.readlink(srcFile), dstFile)
+                    continue
+                if mode == 'hardlink':
+                    try:
+                        os.link(srcFile, dstFile)
+                        self.linked += os.path.getsize(srcFile)
+                        continue
+                    except OSError, why:
+                        if not why.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EACCES):
+                            raise
+                copied += self.copyFile(srcFile, dstFile)
+        return copied
+
+    def getStats(self):
+        """ Bytes copied, linked (hard links, symbolic links, clones) and renamed so far
+        """
+        return {'Copied' : self.copied, 'Linked' : self.linked, 'Renamed' : self.renamed}
@@ -0,0 +1,89 @@
+'''
+Timing of the phases of a workflow step: wall time, CPU time (including the payload) and bytes copied.
+
+>>> profile = StepProfile("marlin_step_1")
+>>> with profile.phase("runIt"):
+...     runIt()
+>>> profile.toJSON()
+'{"step": "marlin_step_1", "phases": {"runIt": [12.1, 11.8, 0]}}'
+
+Each phase is recorded as [wall seconds, CPU seconds, bytes copied]. The bytes staged without copy are in
+staging, see L{Staging.Stager.getStats}. Used by L{ModuleBase.execute}, the records of all steps are combined
+by L{combineProfiles} in L{UserJobFinalization}.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+import os, time, json
+
+class StepProfile(object):
+    """ Phase timers of one step
+    """
+    def __init__(self, stepName):
+        self.stepName = stepName
+        self.phases = {}
+        self.staging = {}
+        self._current = None
+        self._start = None
+
+    def phase(self, name):
+        """ To be used in a with statement
+        """
+        self._current = name
+        if not self.phases.has_key(name):
+            self.phases[name] = [0., 0., 0]
+        return self
+
+    def __enter__(self):
+        times = os.times()
+        self._start = (time.time(), sum(times[:4]))
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        times = os.times()
+        record = self.phases[self._current]
+        record[0] += time.time() - self._start[0]
+        record[1] += sum(times[:4]) - self._start[1]
+        return False
+
+    def addBytes(self, nbytes, phase = None):
+        """ Count bytes copied in the current phase
+        """
+        self.phases[phase or self._current][2] += nbytes
+
+    def toDict(self):
+        """ Rounded values, to keep the records short
+        """
+        record = {'step' : self.stepName,
+                  'phases' : dict([(name, [round(rec[0], 3), round(rec[1], 3), rec[2]])
+                                   for name, rec in self.phases.items()])}
+        if self.staging:
+            record['staging'] = dict(self.staging)
+        return record
+
+    def toJSON(self):
+        """ Compact JSON record
+        """
+        return json.dumps(self.toDict(), separators = (',', ':'), sort_keys = True)
+
+def combineProfiles(records):
+    """ Sum the phases of all the steps records
+
+    @param records: list of L{StepProfile.toDict} results
+    @return: {'steps': records, 'total': {phase: [wall, cpu, bytes]}, 'staging': {'Copied', 'Linked', 'Renamed'}}
+    """
+    total = {}
+    staging = {}
+    for record in records:
+        for name, value in record.get('staging', {}).items():
+            staging[name] = staging.get(name, 0) + value
+        for name, values in record['phases'].items():
+            current = total.setdefault(name, [0., 0., 0])
+            for index in range(3):
+                current[index] += values[index]
+    for values in total.values():
+        values[0] = round(values[0], 3)
+        values[1] = round(values[1], 3)
+    return {'steps' : records, 'total' : total, 'staging' : staging}
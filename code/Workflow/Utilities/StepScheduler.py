@@ -0,0 +1,199 @@
+'''
+Execution of workflow steps in background processes, for the steps that do not depend on each other.
+
+The workflow calls the steps one after the other. When the job allows parallel steps (see
+L{UserJob.setParallelSteps}), a step is started in a child process and the workflow goes on with the next
+step, unless the next step uses its output (it would wait for it right away), it is the last step, or it
+streams. A step first waits for the steps it depends on, as given by the StepDependencies workflow
+parameter built from the L{Application.getInputFromApp} links. The UserJobFinalization waits for all of
+them before uploading anything.
+
+Every step works in its own directory, so the only state shared with the workflow is what the step
+sends back: its result and its changes to the workflow_commons (L{getCommonsChanges}), merged as if the
+step had run in the workflow process. The entries that cannot be pickled, and the L{LOCAL_COMMONS}, are
+not sent back.
+
+>>> scheduler = StepScheduler(maxSteps = 4)
+>>> scheduler.start('app_step_1', module.executeInBackground)
+>>> scheduler.wait(['app_step_1'], workflow_commons)
+{'OK': True, 'Value': None}
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from DIRAC import S_OK, S_ERROR
+
+import multiprocessing, time, cPickle
+
+#: Seconds between two checks of the running steps
+POLL_INTERVAL = 0.5
+
+#: Entries of the workflow_commons that belong to the workflow process
+LOCAL_COMMONS = ['JobReport', 'StepScheduler', 'StreamingSteps']
+
+def _isRequest(value):
+    """ The failover Request, whose operations are sent back one by one
+    """
+    return hasattr(value, 'addOperation')
+
+def _dumps(value):
+    """ Pickled value, None if it cannot be pickled
+    """
+    try:
+        return cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+def snapshotCommons(workflow_commons):
+    """ State of the workflow_commons before the step, for L{getCommonsChanges}
+    """
+    snapshot = {}
+    for key, value in workflow_commons.items():
+        if key in LOCAL_COMMONS:
+            continue
+        if _isRequest(value):
+            snapshot[key] = len(list(value))
+        else:
+            snapshot[key] = _dumps(value)
+    return snapshot
+
+def getCommonsChanges(snapshot, workflow_commons):
+    """ What the step changed in the workflow_commons since the snapshot: new values, items appended to the 
+    lists, entries added or changed in the dictionaries, and operations added to the Request
+    @return: {'Set': {key: value}, 'Extend': {key: list}, 'Update': {key: dict}, 'Operations': {key: list of 
+    operations as JSON}}
+    """
+    changes = {'Set' : {}, 'Extend' : {}, 'Update' : {}, 'Operations' : {}}
+    for key, value in workflow_commons.items():
+        if key in LOCAL_COMMONS:
+            continue
+        if _isRequest(value):
+            operations = []
+            for operation in list(value)[snapshot.get(key, 0):]:
+                res = operation.toJSON()
+                if res['OK']:
+                    operations.append(res['Value'])
+            if operations:
+                changes['Operations'][key] = operations
+            continue
+        dumped = _dumps(value)
+        if dumped is None or snapshot.get(key) == dumped:
+            continue
+        before = None
+        if snapshot.get(key) is not None:
+            before = cPickle.loads(snapshot[key])
+        if type(value) == type([]) and type(before) == type([]) and value[:len(before)] == before:
+            changes['Extend'][key] = value[len(before):]
+        elif type(value) == type({}) and type(before) == type({}):
+            changes['Update'][key] = dict([(name, item) for name, item in value.items() 
+                                           if not before.has_key(name) or before[name] != item])
+        else:
+            changes['Set'][key] = value
+    return changes
+
+def mergeCommons(workflow_commons, changes):
+    """ Apply the L{getCommonsChanges} of a step to the workflow_commons of the workflow process
+    """
+    for key, value in changes.get('Set', {}).items():
+        workflow_commons[key] = value
+    for key, value in changes.get('Extend', {}).items():
+        workflow_commons.setdefault(key, []).extend(value)
+    for key, value in changes.get('Update', {}).items():
+        workflow_commons.setdefault(key, {}).update(value)
+    for key, operations in changes.get('Operations', {}).items():
+        from DIRAC.RequestManagementSystem.Client.Operation import Operation
+        if not workflow_commons.has_key(key):
+            from DIRAC.RequestManagementSystem.Client.Request import Request
+            workflow_commons[key] = Request()
+        for operation in operations:
+            workflow_commons[key].addOperation(Operation(operation))
+
+def _runStep(function, connection):
+    """ Body of the child process: send the result of function to the parent
+    """
+    try:
+        result = function()
+    except Exception, why:
+        result = {'Result' : S_ERROR("Exception in the step: %s" % str(why)), 'Commons' : {}}
+    connection.send(result)
+    connection.close()
+
+class StepScheduler(object):
+    """ Steps running in child processes, at most maxSteps at once
+    """
+    def __init__(self, maxSteps = 1):
+        """
+        @param maxSteps: maximum number of steps running at the same time
+        """
+        self.maxSteps = max(1, maxSteps)
+        self.running = {}
+        self.results = {}
+
+    def start(self, stepName, function):
+        """ Run function in a child process, once fewer than maxSteps steps are running.
+        @param function: returns {'Result': S_OK() or S_ERROR(), 'Commons': L{getCommonsChanges} result}
+        @return: S_OK()
+        """
+        while len(self.running) >= self.maxSteps:
+            self._collect()
+            if len(self.running) >= self.maxSteps:
+                time.sleep(POLL_INTERVAL)
+        parentConnection, childConnection = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(target = _runStep, args = (function, childConnection), name = stepName)
+        process.start()
+        childConnection.close()
+        self.running[stepName] = (process, parentConnection)
+        return S_OK('%s started in the background' % stepName)
+
+    def _collect(self):
+        """ Get the results of the steps that are done
+        """
+        for stepName, (process, connection) in self.running.items():
+            if connection.poll():
+                try:
+                    self.results[stepName] = connection.recv()
+                except EOFError:
+                    #Exited without sending anything
+                    process.join()
+                    self.results[stepName] = {'Result' : S_ERROR("%s died with exit code %s" % (stepName,
+                                                                                             process.exitcode)),
+                                              'Commons' : {}}
+                process.join()
+                connection.close()
+                del self.running[stepName]
+
+    def isRunning(self, stepName):
+        """ True if the step was started and is not done yet
+        """
+        self._collect()
+        return self.running.has_key(stepName)
+
+    def wait(self, stepNames, workflow_commons):
+        """ Wait for the steps, and add what they sent back to the workflow_commons.
+        Steps that were not started in the background are ignored.
+        @return: S_OK() or S_ERROR() listing the failed steps
+        """
+        while [stepName for stepName in stepNames if self.running.has_key(stepName)]:
+            self._collect()
+            if [stepName for stepName in stepNames if self.running.has_key(stepName)]:
+                time.sleep(POLL_INTERVAL)
+        failed = []
+        for stepName in stepNames:
+            if not self.results.has_key(stepName):
+                continue
+            result = self.results[stepName]
+            mergeCommons(workflow_commons, result['Commons'])
+            #Merged once
+            result['Commons'] = {}
+            if not result['Result']['OK']:
+                failed.append('%s: %s' % (stepName, result['Result']['Message']))
+        if failed:
+            return S_ERROR('Failed steps: %s' % '; '.join(failed))
+        return S_OK()
+
+    def waitAll(self, workflow_commons):
+        """ Wait for all the steps started so far
+        """
+        return self.wait(self.running.keys() + self.results.keys(), workflow_commons)
@@ -0,0 +1,178 @@
+'''
+Streaming of the output file of a step to the next step through a named pipe (FIFO).
+
+The workflow runs the steps one after the other. When an application streams its output (see
+L{Application.getInputFromApp}), its step creates the pipe in the job directory, starts the application in the
+background and returns. The next step reads the pipe as its input file while the first application writes it:
+the kernel pipe buffer blocks the writer when the reader is slower, nothing is stored on disk.
+
+>>> producer = StreamingStep('gen_step', '/job/events.stdhep', '/job/gen_step/gen.log', '/job')
+>>> producer.start(['./gen.sh'], env, '/job/gen_step')
+>>> workflow_commons['StreamingSteps']['events.stdhep'] = producer
+>>> ... the next step runs its application on /job/events.stdhep ...
+>>> producer.setConsumer(pid)
+>>> producer.wait()
+{'OK': True, 'Value': 0}
+
+If the producer fails, the consumer registered with L{StreamingStep.setConsumer} is killed. If the consumer
+fails, its step calls L{StreamingStep.abort}. Both run in their own process group, so their children are
+killed with them.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from Workflow.Utilities.ProcessRunner         import runCommand
+from Workflow.Utilities.LogSink               import LogSink
+from DIRAC                                    import S_OK, S_ERROR
+
+import os, errno, signal, shutil, threading
+
+def _kill(pid):
+    """ Terminate a process and its process group, if they still exist
+    """
+    try:
+        os.killpg(pid, signal.SIGTERM)
+        return
+    except OSError:
+        pass
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError, why:
+        if why.errno != errno.ESRCH:
+            raise
+
+def createPipe(path):
+    """ Create the named pipe, replacing any file with that name
+    @return: S_OK() or S_ERROR()
+    """
+    try:
+        if os.path.lexists(path):
+            os.remove(path)
+        os.mkfifo(path)
+    except OSError, why:
+        return S_ERROR("Could not create the pipe %s: %s" % (path, str(why)))
+    return S_OK()
+
+class StreamingStep(object):
+    """ Application of a step running in the background, writing to a named pipe
+    """
+    def __init__(self, stepName, pipe, logFile, basedirectory):
+        """
+        @param stepName: name of the producer step, for the messages
+        @param pipe: absolute path of the named pipe in the job directory
+        @param logFile: absolute path of the application log, moved to basedirectory at the end
+        @param basedirectory: job directory
+        """
+        self.stepName = stepName
+        self.pipe = pipe
+        self.logFile = logFile
+        self.basedirectory = basedirectory
+        self.logSink = LogSink()
+        self.pid = None
+        self.consumer = None
+        self.result = None
+        self.aborted = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, argv, env, cwd):
+        """ Start the application in a thread, it blocks until the consumer opens the pipe
+        """
+        self.logSink.open(self.logFile)
+        self._thread = threading.Thread(target = self._run, args = (argv, env, cwd))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _started(self, pid):
+        self._lock.acquire()
+        try:
+            self.pid = pid
+            if self.aborted:
+                _kill(pid)
+        finally:
+            self._lock.release()
+
+    def writeLog(self, fd, message):
+        """ Write a line to the application log, same arguments as L{ModuleBase.redirectLogOutput}
+        """
+        self.logSink.write(message + '\n')
+        if fd == 1:
+            self.logSink.addStdError(message)
+
+    def _run(self, argv, env, cwd):
+        try:
+            self.result = runCommand(argv, env = env, callbackFunction = self.writeLog, cwd = cwd,
+                                     onStart = self._started, newProcessGroup = True)
+        except Exception, why:
+            self.result = S_ERROR("Streaming %s failed: %s" % (self.stepName, str(why)))
+        self.logSink.close()
+        self._lock.acquire()
+        try:
+            failed = not self.result['OK'] or self.result['Value'] != 0
+            if failed and self.consumer is not None:
+                _kill(self.consumer)
+        finally:
+            self._lock.release()
+        self._done.set()
+
+    def isFailed(self):
+        """ True if the application is done and failed
+        """
+        return self._done.isSet() and (not self.result['OK'] or self.result['Value'] != 0)
+
+    def setConsumer(self, pid):
+        """ Register the process reading the pipe, killed if the application fails
+        """
+        self._lock.acquire()
+        try:
+            self.consumer = pid
+        finally:
+            self._lock.release()
+        if self.isFailed():
+            _kill(pid)
+
+    def abort(self):
+        """ Stop the application, e.g. because the consumer failed
+        """
+        self._lock.acquire()
+        try:
+            self.aborted = True
+            if self.pid is not None and not self._done.isSet():
+                _kill(self.pid)
+        finally:
+            self._lock.release()
+        self.release()
+
+    def release(self):
+        """ Unblock the application if it still waits for a reader to open the pipe, to be called once the 
+        consumer is done: it then fails writing to the pipe instead of waiting forever
+        """
+        try:
+            pipe = os.open(self.pipe, os.O_RDONLY | os.O_NONBLOCK)
+            os.close(pipe)
+        except OSError:
+            pass
+
+    def wait(self):
+        """ Wait for the end of the application, move its log to the job directory and remove the pipe
+        @return: S_OK(status) or S_ERROR()
+        """
+        if self._thread is None:
+            return S_ERROR("%s was not started" % self.stepName)
+        self._thread.join()
+        if os.path.exists(self.logFile):
+            try:
+                shutil.move(self.logFile, os.path.join(self.basedirectory, os.path.basename(self.logFile)))
+            except EnvironmentError, why:
+                return S_ERROR("Failed to move the log of %s: %s" % (self.stepName, str(why)))
+        if os.path.lexists(self.pipe):
+            os.remove(self.pipe)
+        return self.result
+
+    def getStdError(self):
+        """ The end of the standard error of the application
+        """
+        return self.logSink.getStdError()
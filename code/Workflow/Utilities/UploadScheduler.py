@@ -0,0 +1,71 @@
+'''
+Run file transfers concurrently, with a global limit and a limit per storage element.
+
+Used by L{UserJobFinalization} to upload the output files. A transfer that falls back from one SE to the next
+takes the slot of every SE while it tries it, with L{UploadScheduler.runOnSE}.
+
+The transfer functions run in several threads: they must not share clients that are not thread safe. The
+UserJobFinalization creates a FailoverTransfer (and so a ReplicaManager) per transfer, and merges the requests
+under a lock. Set maxTransfers to 1 to run the transfers one after the other.
+
+@author: Stephane Poss
+'''
+
+__RCSID__ = "$Id: $"
+
+from Core.Utilities.ThreadedMap           import threadedMap
+
+import threading
+
+class UploadScheduler(object):
+    """ Call a transfer function on a list of items, never running more than maxTransfers of them
+    at once, and never more than the SE limit for a given SE.
+    """
+    def __init__(self, maxTransfers = 4, maxPerSE = 2, seLimits = None):
+        """
+        @param maxTransfers: maximum number of concurrent transfers
+        @param maxPerSE: maximum number of concurrent transfers to the same SE, when not in seLimits
+        @param seLimits: per SE maximum number of concurrent transfers {SE: limit}
+        """
+        self.maxTransfers = max(int(maxTransfers), 1)
+        self.maxPerSE = max(int(maxPerSE), 1)
+        self.seLimits = {}
+        for se, limit in (seLimits or {}).items():
+            self.seLimits[se] = max(int(limit), 1)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _getSemaphore(self, se):
+        """ Return the semaphore limiting the transfers to the SE
+        """
+        self._lock.acquire()
+        try:
+            if not self._semaphores.has_key(se):
+                self._semaphores[se] = threading.BoundedSemaphore(self.seLimits.get(se, self.maxPerSE))
+            return self._semaphores[se]
+        finally:
+            self._lock.release()
+
+    def runOnSE(self, se, function, *args, **kwargs):
+        """ Call function(*args, **kwargs) once fewer than the SE limit of transfers to the SE are running
+        @return: the result of function
+        """
+        semaphore = self._getSemaphore(se)
+        semaphore.acquire()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            semaphore.release()
+
+    def run(self, function, items, getSE = None):
+        """ Call function(item) for all items.
+
+        @param function: transfer function, returns S_OK/S_ERROR
+        @param items: list of items to pass to the function
+        @param getSE: function returning the SE an item is transferred to. If None, the function limits its 
+        transfers itself with L{runOnSE}, e.g. because it tries several SEs.
+        @return: list of the results, in the same order as the items
+        """
+        if getSE is None:
+            return threadedMap(function, items, self.maxTransfers)
+        return threadedMap(lambda item: self.runOnSE(getSE(item), function, item), items, self.maxTransfers)